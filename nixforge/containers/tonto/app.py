@@ -1,15 +1,27 @@
-import os, json, tempfile, subprocess, shutil
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+import os, io, json, tempfile, subprocess, shutil, wave, queue, select
+from contextlib import asynccontextmanager, aclosing
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
 import re
 from pathlib import Path
 import time
-from collections import deque
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import hashlib
+import sqlite3
+import uuid
+import unicodedata
+from collections import deque, OrderedDict
 
 # Autenticación Google (ADC)
 import google.auth
 from google.auth.transport.requests import Request as GARequest
 import requests
+import httpx
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
 
 def _project_from_credentials():
     path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
@@ -29,27 +41,188 @@ MODEL_ID = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
 if not PROJECT:
     raise RuntimeError("No se pudo determinar el proyecto. Define GCP_PROJECT_ID o pon 'project_id' en el JSON de credenciales.")
 
-_AIP_BASE = f"https://{LOCATION}-aiplatform.googleapis.com"
-_GEN_URL  = f"{_AIP_BASE}/v1beta1/projects/{PROJECT}/locations/{LOCATION}/publishers/google/models/{MODEL_ID}:generateContent"
+# VERTEX_BASE_URL y VERTEX_STATIC_TOKEN permiten apuntar a un servidor local
+# (bench/vertex_stub.py) sin credenciales reales.
+_AIP_BASE   = os.getenv("VERTEX_BASE_URL", f"https://{LOCATION}-aiplatform.googleapis.com").rstrip("/")
+_LOCATION_PATH = f"projects/{PROJECT}/locations/{LOCATION}"
+_MODEL_NAME = f"{_LOCATION_PATH}/publishers/google/models/{MODEL_ID}"
+_GEN_URL    = f"{_AIP_BASE}/v1beta1/{_MODEL_NAME}:generateContent"
+_STREAM_URL = f"{_AIP_BASE}/v1beta1/{_MODEL_NAME}:streamGenerateContent?alt=sse"
+_COUNT_URL  = f"{_AIP_BASE}/v1beta1/{_MODEL_NAME}:countTokens"
+_CACHE_URL  = f"{_AIP_BASE}/v1beta1/{_LOCATION_PATH}/cachedContents"
+
+class LatencyWindow:
+    """Últimas ``size`` latencias de una dependencia, para p50/p95 móviles."""
+
+    def __init__(self, size: int = 256):
+        self.samples: deque = deque(maxlen=size)
+
+    def observe(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def summary(self) -> dict:
+        data = sorted(self.samples)
+        if not data:
+            return {"n": 0}
+        pick = lambda q: round(data[min(len(data) - 1, int(q * len(data)))] * 1000, 1)
+        return {"n": len(data), "p50_ms": pick(0.50), "p95_ms": pick(0.95)}
+
+_LATENCY: dict[str, LatencyWindow] = {}
+
+# /metrics (Prometheus): las mismas etapas que _LATENCY, pero en histogramas acumulados
+_STAGE_SECONDS = Histogram("tonto_stage_seconds", "Latencia por etapa (token, vertex, tts, playback, probe_*)",
+                           ["stage"], buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32))
+_TTS_FALLBACKS = Counter("tonto_tts_fallback_total", "Frases sintetizadas con espeak porque piper falló")
+_CACHE_LOOKUPS = Counter("tonto_cache_lookups_total", "Consultas a cachés (tts, context)", ["cache", "result"])
+_ERRORS        = Counter("tonto_errors_total", "Errores por sitio y tipo", ["where", "type"])
+_IN_FLIGHT     = Gauge("tonto_requests_in_flight", "Peticiones HTTP en curso", ["endpoint"])
+_TOKENS        = Counter("tonto_tokens_total", "Tokens de Vertex según usageMetadata", ["kind"])
+_ANSWER_PATHS  = Counter("tonto_answer_path_total", "Respuestas por camino (llm o intent:<nombre>)", ["path"])
+_FILLERS       = Counter("tonto_filler_total", "Frases de relleno reproducidas mientras el LLM tardaba")
+_SPECULATION   = Counter("tonto_speculation_total", "Comandos de /ingest por resultado de la especulación "
+                         "(hit, miss, none, aborted)", ["result"])
+_SPEC_HEAD_START = Histogram("tonto_speculation_head_start_seconds",
+                             "Ventaja del LLM en las especulaciones acertadas (de su arranque al texto final)",
+                             buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8))
+
+def _observe(stage: str, seconds: float) -> None:
+    window = _LATENCY.get(stage)
+    if window is None:
+        window = _LATENCY[stage] = LatencyWindow()
+    window.observe(seconds)
+    _STAGE_SECONDS.labels(stage).observe(seconds)
+
+def _count_error(where: str, exc: BaseException | str) -> None:
+    _ERRORS.labels(where, exc if isinstance(exc, str) else type(exc).__name__).inc()
 
 def _to_bytes(x) -> bytes:
     if isinstance(x, (bytes, bytearray)):
         return bytes(x)
     return str(x).encode("utf-8", errors="replace")
 
-def _get_access_token() -> str:
-    creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-    if not creds.valid:
-        creds.refresh(GARequest())
-    return creds.token
-
-def _vertex_generate_text(prompt: str) -> str:
-    token = _get_access_token()
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json; charset=utf-8",
-    }
-    body = {
+_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+VERTEX_POOL_SIZE       = int(os.getenv("VERTEX_POOL_SIZE", "4"))
+VERTEX_CONNECT_TIMEOUT = float(os.getenv("VERTEX_CONNECT_TIMEOUT", "5"))
+VERTEX_READ_TIMEOUT    = float(os.getenv("VERTEX_READ_TIMEOUT", "60"))
+VERTEX_REFRESH_MARGIN  = float(os.getenv("VERTEX_REFRESH_MARGIN", "300"))
+VERTEX_STATIC_TOKEN    = os.getenv("VERTEX_STATIC_TOKEN", "")
+
+class VertexClient:
+    """Cliente de Vertex de larga vida: credenciales ADC cacheadas durante todo el
+    proceso, refresco del token en segundo plano antes de que caduque y un
+    cliente HTTP asíncrono con pool keep-alive para no repetir el handshake TLS."""
+
+    def __init__(self, pool_size: int, connect_timeout: float, read_timeout: float, refresh_margin: float,
+                 static_token: str = ""):
+        self.pool_size = pool_size
+        self.static_token = static_token
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.refresh_margin = refresh_margin
+        self._client: httpx.AsyncClient | None = None
+        self._auth_session = requests.Session()  # solo para refrescar el token (google-auth es síncrono)
+        self._creds = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher: threading.Thread | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout, limits=limits,
+                headers={"Content-Type": "application/json; charset=utf-8"},
+            )
+        return self._client
+
+    def _seconds_left(self) -> float | None:
+        expiry = getattr(self._creds, "expiry", None)
+        if expiry is None:
+            return None
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return (expiry - now).total_seconds()
+
+    def _refresh_locked(self) -> None:
+        t = time.perf_counter()
+        if self._creds is None:
+            self._creds, _ = google.auth.default(scopes=_SCOPES)
+        self._creds.refresh(GARequest(session=self._auth_session))
+        _observe("token", time.perf_counter() - t)
+
+    def token_state(self) -> dict:
+        if self.static_token:
+            return {"valid": True, "static": True}
+        creds = self._creds
+        left = self._seconds_left()
+        return {"valid": bool(creds is not None and creds.valid),
+                "expires_in_s": None if left is None else int(left)}
+
+    def _refresh_loop(self) -> None:
+        while not self._stop.is_set():
+            with self._lock:
+                left = self._seconds_left()
+            wait = 3600.0 if left is None else max(5.0, left - self.refresh_margin)
+            if self._stop.wait(wait):
+                return
+            try:
+                with self._lock:
+                    self._refresh_locked()
+            except Exception as e:
+                print(f"[tonto] refresco de token falló: {e}", flush=True)
+                self._stop.wait(30.0)
+
+    def token(self) -> str:
+        if self.static_token:
+            return self.static_token
+        with self._lock:
+            if self._creds is None or not self._creds.valid:
+                self._refresh_locked()
+            token = self._creds.token
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, name="vertex-token", daemon=True)
+            self._refresher.start()
+        return token
+
+    async def token_async(self) -> str:
+        if self.static_token:
+            return self.static_token
+        creds = self._creds
+        if creds is not None and creds.valid and self._refresher is not None:
+            return creds.token  # camino normal: el hilo de refresco lo mantiene vigente
+        return await asyncio.to_thread(self.token)
+
+    async def post(self, url: str, body: dict) -> httpx.Response:
+        headers = {"Authorization": f"Bearer {await self.token_async()}"}
+        return await self.client.post(url, headers=headers, json=body)
+
+    @asynccontextmanager
+    async def stream(self, url: str, body: dict):
+        headers = {"Authorization": f"Bearer {await self.token_async()}"}
+        async with self.client.stream("POST", url, headers=headers, json=body) as resp:
+            yield resp
+
+    async def aclose(self) -> None:
+        self._stop.set()
+        self._auth_session.close()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+_VERTEX = VertexClient(VERTEX_POOL_SIZE, VERTEX_CONNECT_TIMEOUT, VERTEX_READ_TIMEOUT, VERTEX_REFRESH_MARGIN,
+                       VERTEX_STATIC_TOKEN)
+
+# Límites de concurrencia por etapa: cuántas generaciones a la vez contra Vertex
+# y cuántas síntesis en paralelo (tamaño del pool de hilos del TTS). La
+# reproducción no necesita límite: la hace un único planificador (ver SpeakJob).
+LLM_CONCURRENCY  = int(os.getenv("TONTO_LLM_CONCURRENCY", "4"))
+TTS_CONCURRENCY  = int(os.getenv("TONTO_TTS_CONCURRENCY", "1"))
+
+_LLM_SEM  = asyncio.Semaphore(LLM_CONCURRENCY)
+_TTS_POOL = ThreadPoolExecutor(max_workers=TTS_CONCURRENCY, thread_name_prefix="tts")
+
+def _prompt_body(prompt: str) -> dict:
+    return {
         "contents": [
             {
                 "role": "user",
@@ -57,17 +230,184 @@ def _vertex_generate_text(prompt: str) -> str:
             }
         ]
     }
-    resp = requests.post(_GEN_URL, headers=headers, json=body, timeout=60)
+
+def _candidate_text(data: dict) -> str:
+    try:
+        parts = data["candidates"][0]["content"]["parts"]
+    except (KeyError, IndexError, TypeError):
+        return ""
+    return "".join(p.get("text", "") for p in parts)
+
+CONTEXT_CACHE     = os.getenv("TONTO_CONTEXT_CACHE", "false").lower() in ("1","true","yes")
+CONTEXT_CACHE_TTL = int(os.getenv("TONTO_CONTEXT_CACHE_TTL", "3600"))
+
+class SystemPromptCache:
+    """Registra el system prompt (estático) como ``cachedContent`` en Vertex y
+    lo referencia por nombre, para no reenviar ni volver a procesar esos tokens
+    en cada pregunta.
+
+    Si Vertex rechaza el caché (p. ej. el prompt no llega al mínimo de tokens
+    cacheables) se usa ``systemInstruction`` en línea y no se reintenta hasta
+    pasada una hora.
+    """
+
+    def __init__(self, enabled: bool, ttl: int):
+        self.enabled = enabled
+        self.ttl = ttl
+        self._names: dict[str, tuple[str, float]] = {}  # sha del prompt → (nombre, caduca)
+        self._systems: dict[str, str] = {}              # nombre → prompt, para volver a línea
+        self._retry_at: dict[str, float] = {}
+        self._lock = asyncio.Lock()
+
+    async def attach(self, body: dict, system: str) -> None:
+        name = await self._name_for(system) if self.enabled else None
+        if name:
+            body["cachedContent"] = name
+        else:
+            body["systemInstruction"] = {"parts": [{"text": system}]}
+
+    async def _name_for(self, system: str) -> str | None:
+        key = hashlib.sha256(system.encode("utf-8")).hexdigest()
+        now = time.monotonic()
+        async with self._lock:
+            hit = self._names.get(key)
+            if hit and hit[1] > now:
+                _CACHE_LOOKUPS.labels("context", "hit").inc()
+                return hit[0]
+            if self._retry_at.get(key, 0.0) > now:
+                _CACHE_LOOKUPS.labels("context", "inline").inc()
+                return None
+            _CACHE_LOOKUPS.labels("context", "miss").inc()
+            body = {"model": _MODEL_NAME, "systemInstruction": {"parts": [{"text": system}]}, "ttl": f"{self.ttl}s"}
+            try:
+                resp = await _VERTEX.post(_CACHE_URL, body)
+                if resp.status_code != 200:
+                    raise RuntimeError(f"{resp.status_code} {resp.text[:200]}")
+                name = resp.json()["name"]
+            except Exception as e:
+                print(f"[tonto] cachedContent no disponible, systemInstruction en línea: {e}", flush=True)
+                self._retry_at[key] = now + 3600.0
+                return None
+            self._names[key] = (name, now + self.ttl - 60.0)
+            self._systems[name] = system
+            return name
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "entries": len(self._names), "ttl": self.ttl}
+
+    def inline(self, body: dict) -> dict:
+        """Quita un ``cachedContent`` que Vertex ya no reconoce y pone el prompt en línea."""
+        name = body.get("cachedContent")
+        system = self._systems.pop(name, None)
+        self._names = {k: v for k, v in self._names.items() if v[0] != name}
+        body = {k: v for k, v in body.items() if k != "cachedContent"}
+        if system:
+            body["systemInstruction"] = {"parts": [{"text": system}]}
+        return body
+
+_SYSTEM_CACHE = SystemPromptCache(CONTEXT_CACHE, CONTEXT_CACHE_TTL)
+
+_USAGE_KEYS = ("promptTokenCount", "cachedContentTokenCount", "candidatesTokenCount", "totalTokenCount")
+_USAGE_TOTALS = {"requests": 0, **{k: 0 for k in _USAGE_KEYS}}
+
+def _account(usage: dict) -> dict:
+    _USAGE_TOTALS["requests"] += 1
+    for k in _USAGE_KEYS:
+        _USAGE_TOTALS[k] += int(usage.get(k, 0))
+        if k != "totalTokenCount":
+            _TOKENS.labels(k.removesuffix("TokenCount")).inc(int(usage.get(k, 0)))
+    return usage
+
+def _stale_cache(resp: httpx.Response, body: dict) -> bool:
+    return "cachedContent" in body and resp.status_code in (400, 404)
+
+async def _vertex_stream_text(body: dict, usage: dict | None = None):
+    """Genera el texto por trozos usando streamGenerateContent (SSE).
+    Si se pasa ``usage`` se rellena con el usageMetadata del último evento."""
+    async with _LLM_SEM:
+        t = time.perf_counter()
+        for attempt in range(2):
+            async with _VERTEX.stream(_STREAM_URL, body) as resp:
+                if resp.status_code != 200:
+                    await resp.aread()
+                    if attempt == 0 and _stale_cache(resp, body):
+                        body = _SYSTEM_CACHE.inline(body)
+                        continue
+                    raise RuntimeError(f"{resp.status_code} {resp.text}")
+                meta: dict = {}
+                async for line in resp.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = json.loads(line[5:])
+                    meta = data.get("usageMetadata") or meta
+                    chunk = _candidate_text(data)
+                    if chunk:
+                        yield chunk
+                _observe("vertex", time.perf_counter() - t)
+                _account(meta)
+                if usage is not None:
+                    usage.update(meta)
+                return
+
+async def _vertex_generate(body: dict) -> tuple[str, dict]:
+    async with _LLM_SEM:
+        t = time.perf_counter()
+        resp = await _VERTEX.post(_GEN_URL, body)
+        if _stale_cache(resp, body):
+            resp = await _VERTEX.post(_GEN_URL, _SYSTEM_CACHE.inline(body))
     if resp.status_code != 200:
         raise RuntimeError(f"{resp.status_code} {resp.text}")
+    _observe("vertex", time.perf_counter() - t)
 
     data = resp.json()
+    usage = _account(data.get("usageMetadata") or {})
+    if not data.get("candidates"):
+        return json.dumps(data), usage
+    return _candidate_text(data).strip(), usage
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
     try:
-        return data["candidates"][0]["content"]["parts"][0].get("text", "").strip()
-    except Exception:
-        return json.dumps(data)
+        await asyncio.to_thread(_VERTEX.token)  # precalienta credenciales y arranca el refresco
+    except Exception as e:
+        print(f"[tonto] aviso: no se pudo obtener token al arrancar: {e}", flush=True)
+    try:
+        await asyncio.get_running_loop().run_in_executor(_TTS_POOL, _PIPER.start)
+    except Exception as e:
+        print(f"[tonto] aviso: piper no arrancó: {e}", flush=True)
+    await _CUES.load()
+    _SPEAK.start()
+    _HEALTH.start()
+    yield
+    await _HEALTH.stop()
+    await _SPEAK.stop()
+    _PIPER.close()
+    _TTS_POOL.shutdown(wait=False)
+    _HISTORY.close()
+    await _VERTEX.aclose()
+
+app = FastAPI(title="tonto", lifespan=_lifespan)
+
+_TRACKED_PATHS = {"/ask", "/speak", "/ingest", "/barge-in"}
 
-app = FastAPI(title="tonto")
+@app.middleware("http")
+async def _in_flight(request: Request, call_next):
+    path = request.url.path
+    if path == "/metrics":
+        return await call_next(request)
+    gauge = _IN_FLIGHT.labels(path if path in _TRACKED_PATHS else "other")
+    gauge.inc()
+    try:
+        response = await call_next(request)
+    finally:
+        gauge.dec()
+    if response.status_code >= 500:
+        _count_error("http", f"http_{response.status_code}")
+    return response
+
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 system_prompt = os.getenv("TONTO_SYSTEM_PROMPT", """
 You are a helpful assistant named Tonto, designed to answer questions and provide information in Spanish.
@@ -91,164 +431,1291 @@ Besides the personality, you have to be professional and only make use of this p
 Your TTS is powered by Piper, a text-to-speech engine that generates audio from text.
 Don't generate any text that cannot be spoken or laughs (such as `Ha!`, `¡Ja!`, `Ja, Ja, Ja` or `Ha, Ha, Ha`).
 Using markdonw is not allowed, just plain text.
-You have a history of conversations of 4 messages, so you can refer to previous messages if needed.
-The history is structured as follows:
-  * [user] User's question or message
-  * [assistant] Assistant's response
-  * [system] System prompt or instructions
-You cannot add [assistant] or [/assistant] or [user] or [/user] tags to your responses, this is managed by the system.
+You receive the recent conversation history as previous turns, so you can refer to previous messages if needed.
 If the user says incoherent things, you can reply saying that you didn't understood what they were saying.
 Bear in mind that the input you're receiving comes from speech-to-text, so use the history to try understand what the user tried to say, the speech-to-text may have transcripted wrongly
 """)
 
+STREAM_DEFAULT     = os.getenv("TONTO_STREAM", "false").lower() in ("1","true","yes")
+STREAM_MIN_CHARS   = int(os.getenv("TONTO_STREAM_MIN_CHARS", "24"))
+SPEAK_QUEUE_SIZE   = int(os.getenv("TONTO_SPEAK_QUEUE", "8"))
+SPEAK_WORKERS      = int(os.getenv("TONTO_SPEAK_WORKERS", "2"))
+SPEAK_JOBS_KEPT    = int(os.getenv("TONTO_SPEAK_JOBS_KEPT", "64"))
+# Si el altavoz lleva TONTO_FILLER_AFTER_MS esperando al LLM suena una frase de relleno (0 = nunca)
+FILLER_AFTER_MS    = int(os.getenv("TONTO_FILLER_AFTER_MS", "0"))
+# /ingest: se especula con parciales de al menos SPECULATE_MIN_WORDS palabras, como mucho SPECULATE_MAX veces
+SPECULATE           = os.getenv("TONTO_SPECULATE", "true").lower() in ("1", "true", "yes")
+SPECULATE_MIN_WORDS = int(os.getenv("TONTO_SPECULATE_MIN_WORDS", "3"))
+SPECULATE_MAX       = int(os.getenv("TONTO_SPECULATE_MAX", "2"))
+FILLER_PHRASES     = [p.strip() for p in os.getenv("TONTO_FILLER_PHRASES", "Un momento.|Déjame pensar.|A ver.").split("|")
+                      if p.strip()]
+DEFAULT_SESSION    = "default"
+
 class AskBody(BaseModel):
     question: str
     system: str | None = system_prompt
+    session: str = DEFAULT_SESSION
+    stream: bool | None = None
+    wait: bool = False
+    source: str | None = None   # micrófono/fuente de hotword que oyó el comando
 
-_TTL_SECONDS = 5 * 60
-_MAX_HISTORY = 4
-_HISTORY = deque(maxlen=64)
+HISTORY_TTL          = float(os.getenv("TONTO_HISTORY_TTL", str(5 * 60)))
+HISTORY_TOKENS       = int(os.getenv("TONTO_HISTORY_TOKENS", "800"))
+HISTORY_MAX_TURNS    = int(os.getenv("TONTO_HISTORY_MAX_TURNS", "32"))
+HISTORY_MAX_SESSIONS = int(os.getenv("TONTO_HISTORY_SESSIONS", "64"))
+HISTORY_DB           = os.getenv("TONTO_HISTORY_DB", "")
 
 def _now() -> float:
     return time.time()
 
-def _prune_history() -> None:
-    cutoff = _now() - _TTL_SECONDS
-    alive = [m for m in _HISTORY if m["ts"] >= cutoff]
-    _HISTORY.clear()
-    _HISTORY.extend(alive)
-
-def _recent_history() -> list[dict]:
-    _prune_history()
-    return list(_HISTORY)[- _MAX_HISTORY :]
-
-def _format_turn(role: str, text: str) -> str:
-    if role == "user":
-        return f"[user]{text}[/user]"
-    elif role == "assistant":
-        return f"[assistant]{text}[/assistant]"
-    elif role == "system":
-        return f"[system]{text}[/system]"
-    else:
-        return text
+def _estimate_tokens(text: str) -> int:
+    # ~4 caracteres por token; suficiente para repartir el presupuesto de contexto.
+    return len(text) // 4 + 1
 
-def _record(role: str, text: str) -> None:
-    _HISTORY.append({"ts": _now(), "role": role, "text": text})
+class ConversationStore:
+    """Historial de conversación por sesión (un hotword, un dispositivo…).
 
-def _ask_text(question: str, system: str | None = None) -> str:
-    parts: list[str] = []
-    if system:
-        parts.append(_format_turn("system", system))
+    Cada sesión es un deque ordenado por tiempo: lo caducado se quita por la
+    izquierda, sin reconstruir nada. La memoria está acotada por
+    ``max_turns`` por sesión y ``max_sessions`` sesiones (se descarta la menos
+    usada). Con ``db_path`` los turnos se guardan además en SQLite y se
+    recargan al arrancar; las escrituras van a un hilo propio, en orden, para
+    no bloquear el bucle de eventos.
+    """
+
+    def __init__(self, ttl: float, max_turns: int, max_sessions: int, db_path: str = ""):
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict[str, deque] = OrderedDict()
+        self._db: sqlite3.Connection | None = None
+        self._writer: ThreadPoolExecutor | None = None
+        self._writes = 0
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, path: str) -> None:
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            db = sqlite3.connect(path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS turns (session TEXT, ts REAL, role TEXT, text TEXT)")
+            db.execute("CREATE INDEX IF NOT EXISTS turns_ts ON turns (ts)")
+            rows = db.execute("SELECT session, ts, role, text FROM turns WHERE ts >= ? ORDER BY ts",
+                              (_now() - self.ttl,)).fetchall()
+        except sqlite3.Error as e:
+            print(f"[tonto] historial persistente desactivado ({path}): {e}", flush=True)
+            return
+        self._db = db
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tonto-history")
+        for session, ts, role, text in rows:
+            self._turns(session).append({"ts": ts, "role": role, "text": text})
+
+    def _turns(self, session: str) -> deque:
+        turns = self._sessions.get(session)
+        if turns is None:
+            turns = self._sessions[session] = deque(maxlen=self.max_turns)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session)
+        return turns
+
+    def _expire(self, turns: deque) -> None:
+        cutoff = _now() - self.ttl
+        while turns and turns[0]["ts"] < cutoff:
+            turns.popleft()
+
+    def append(self, session: str, role: str, text: str) -> None:
+        turn = {"ts": _now(), "role": role, "text": text}
+        turns = self._turns(session)
+        self._expire(turns)
+        turns.append(turn)
+        if self._writer is not None:
+            self._writer.submit(self._persist, session, turn)
 
-    for m in _recent_history():
-        parts.append(_format_turn(m["role"], m["text"]))
+    def close(self) -> None:
+        """Espera a las escrituras pendientes y cierra la base de datos."""
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
 
-    parts.append(_format_turn("user", question))
-    contents = "\n".join(parts)
+    def _persist(self, session: str, turn: dict) -> None:
+        try:
+            self._db.execute("INSERT INTO turns VALUES (?, ?, ?, ?)", (session, turn["ts"], turn["role"], turn["text"]))
+            self._writes += 1
+            if self._writes % 64 == 0:
+                self._db.execute("DELETE FROM turns WHERE ts < ?", (_now() - self.ttl,))
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"[tonto] historial: no se pudo guardar: {e}", flush=True)
+
+    def context(self, session: str, budget_tokens: int) -> list[dict]:
+        """Los turnos más recientes que caben en ``budget_tokens``, en orden
+        cronológico y empezando siempre por un turno del usuario."""
+        turns = self._sessions.get(session)
+        if not turns:
+            return []
+        self._expire(turns)
+        picked: list[dict] = []
+        used = 0
+        for turn in reversed(turns):
+            used += _estimate_tokens(turn["text"])
+            if used > budget_tokens:
+                break
+            picked.append(turn)
+        while picked and picked[-1]["role"] != "user":
+            picked.pop()
+        picked.reverse()
+        return picked
+
+    def last(self, session: str, role: str) -> str | None:
+        turns = self._sessions.get(session)
+        if not turns:
+            return None
+        self._expire(turns)
+        return next((t["text"] for t in reversed(turns) if t["role"] == role), None)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "turns": sum(len(t) for t in self._sessions.values()),
+            "persistent": self._db is not None,
+        }
 
-    answer = _vertex_generate_text(contents).strip()
+_HISTORY = ConversationStore(HISTORY_TTL, HISTORY_MAX_TURNS, HISTORY_MAX_SESSIONS, HISTORY_DB)
+
+async def _build_request(question: str, system: str | None = None, session: str = DEFAULT_SESSION) -> dict:
+    """Petición multi‑turno nativa: historial como ``contents`` con roles
+    user/model (turnos seguidos del mismo rol se juntan) y el system prompt
+    como ``systemInstruction`` o, si está activado, como ``cachedContent``."""
+    contents: list[dict] = []
+    turns = [(m["role"], m["text"]) for m in _HISTORY.context(session, HISTORY_TOKENS)]
+    for role, text in turns + [("user", question)]:
+        role = "model" if role == "assistant" else "user"
+        if contents and contents[-1]["role"] == role:
+            contents[-1]["parts"].append({"text": text})
+        else:
+            contents.append({"role": role, "parts": [{"text": text}]})
+    body: dict = {"contents": contents}
+    if system:
+        await _SYSTEM_CACHE.attach(body, system)
+    return body
 
-    _record("user", question)
+def _remember(question: str, answer: str, session: str = DEFAULT_SESSION) -> None:
+    _HISTORY.append(session, "user", question)
     if answer:
-        _record("assistant", answer)
+        _HISTORY.append(session, "assistant", answer)
+
+async def _ask(question: str, system: str | None = None, session: str = DEFAULT_SESSION) -> tuple[str, dict]:
+    answer, usage = await _vertex_generate(await _build_request(question, system, session))
+    _remember(question, answer, session)
+    return answer, usage
+
+def _clean_for_tts(text: str) -> str:
+    text = re.sub(r"<[^>]+>", "", text)  # remove HTML tags
+    text = re.sub(r"\[/?[a-z]+\]", "", text)  # remove [user] and [/user] tags
+    text = re.sub(r"#\w+", "", text)  # remove hashtags
+    text = re.sub(r"\s+", " ", text).strip()  # normalize whitespace
+    text = text.replace("\n", " ")  # replace newlines with spaces
+    text = text.replace("*", " ").replace("_", " ")  # replace * and _ with spaces
+    return text
+
+# --- Intenciones locales: órdenes simples que se contestan sin llamar a Vertex ---
+
+INTENTS_ENABLED = os.getenv("TONTO_INTENTS", "true").lower() in ("1", "true", "yes")
+VOLUME_STEP     = os.getenv("TONTO_VOLUME_STEP", "10%")
+
+class Intent:
+    """Una intención local: patrones (``re.fullmatch`` sobre el texto
+    normalizado: minúsculas, sin tildes ni puntuación) y el handler que da el
+    texto a decir. Con ``remember=False`` no entra en el historial."""
+
+    def __init__(self, name: str, patterns: list, handler, remember: bool = True):
+        self.name = name
+        self.patterns = patterns
+        self.handler = handler
+        self.remember = remember
+
+_INTENTS: list[Intent] = []
+
+def register_intent(name: str, *patterns: str, remember: bool = True):
+    """Decorador: ``handler(m, session, job)`` devuelve el texto a decir
+    (``""`` = nada que decir) o ``None`` para dejar la frase al LLM. Puede ser
+    una corrutina; ``job`` es el ``SpeakJob`` en /speak y ``None`` en /ask."""
+    def deco(fn):
+        _INTENTS.append(Intent(name, [re.compile(p) for p in patterns], fn, remember))
+        return fn
+    return deco
 
+# Muletillas que no cambian la orden ("oye, ¿qué hora es?, por favor")
+_FILLER = re.compile(r"^(?:oye|eh|vale|venga|a ver|por favor|porfa)\b\s*|\s*\b(?:por favor|porfa|gracias)$")
+
+def _normalize_command(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", text)).strip()
+    prev = None
+    while prev != text:
+        prev, text = text, _FILLER.sub("", text).strip()
+    return text
+
+def _match_intent(question: str) -> tuple[Intent, re.Match] | None:
+    if not INTENTS_ENABLED:
+        return None
+    text = _normalize_command(question)
+    for intent in _INTENTS:
+        for pattern in intent.patterns:
+            m = pattern.fullmatch(text)
+            if m:
+                return intent, m
+    return None
+
+async def _run_intent(hit: tuple[Intent, re.Match], question: str, session: str, job=None) -> str | None:
+    intent, m = hit
+    t = time.perf_counter()
+    answer = intent.handler(m, session, job)
+    if asyncio.iscoroutine(answer):
+        answer = await answer
+    _observe("intent", time.perf_counter() - t)
+    if answer is not None:
+        _ANSWER_PATHS.labels(f"intent:{intent.name}").inc()
+        if intent.remember:
+            _remember(question, answer, session)
     return answer
 
+_WEEKDAYS = ("lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo")
+_MONTHS = ("enero", "febrero", "marzo", "abril", "mayo", "junio", "julio", "agosto",
+           "septiembre", "octubre", "noviembre", "diciembre")
+
+@register_intent("hora", r"(?:que hora es|que horas son|(?:me )?(?:dices|dime) la hora|la hora)")
+def _intent_time(m, session, job):
+    now = datetime.now()
+    h = now.hour % 12 or 12
+    part = ("de la madrugada" if now.hour < 6 else "de la mañana" if now.hour < 12
+            else "de la tarde" if now.hour < 21 else "de la noche")
+    mins = {0: "en punto", 15: "y cuarto", 30: "y media"}.get(now.minute, f"y {now.minute}")
+    return f"{'Es la' if h == 1 else 'Son las'} {h} {mins} {part}."
+
+@register_intent("fecha", r"(?:que dia es(?: hoy)?|a que dia estamos|que fecha es(?: hoy)?|(?:me )?(?:dices|dime) la fecha|la fecha)")
+def _intent_date(m, session, job):
+    today = datetime.now()
+    return f"Hoy es {_WEEKDAYS[today.weekday()]}, {today.day} de {_MONTHS[today.month - 1]} de {today.year}."
+
+@register_intent("para", r"(?:para|paralo|parar|para ya|detente|callate|calla|basta|stop|silencio|deja de hablar)",
+                 remember=False)
+def _intent_stop(m, session, job):
+    # La wakeword ya cortó lo que sonaba (barge-in); aquí se vacía también lo encolado
+    for other in list(_SPEAK.jobs.values()):
+        if other is not job and not other.finished.is_set():
+            _SPEAK.cancel(other)
+    return ""
+
+@register_intent("repite", r"(?:repite|repitelo|repitemelo|repite eso|repitelo otra vez|que has dicho|puedes repetir(?:lo)?)",
+                 remember=False)
+def _intent_repeat(m, session, job):
+    return _HISTORY.last(session, "assistant") or "No tengo nada que repetir."
+
+@register_intent("volumen", r"(?P<dir>sube|baja)(?: el)? volumen(?: un poco)?",
+                 r"(?:habla |ponlo |pon )?mas (?P<dir>alto|bajo)", remember=False)
+async def _intent_volume(m, session, job):
+    sign = "+" if m.group("dir") in ("sube", "alto") else "-"
+    if AUDIO_SINK == "pulse":
+        pactl = shutil.which("pactl") or "/run/current-system/sw/bin/pactl"
+        proc = await asyncio.create_subprocess_exec(
+            pactl, f"--server={_pulse_server()}", "set-sink-volume", "@DEFAULT_SINK@", f"{sign}{VOLUME_STEP}",
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+        )
+        _, err = await proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError(f"pactl rc={proc.returncode}: {err.decode('utf-8', 'ignore').strip()}")
+    return "Vale."
+
+# Fin de frase: puntuación seguida de espacio (así "3.5" o "etc.," no cortan a mitad).
+_SENTENCE_END = re.compile(r"[.!?…;:]+[\"'»”)\]]*\s+")
+
+class _SentenceSplitter:
+    """Acumula el texto que llega en streaming y devuelve frases completas.
+
+    Las frases más cortas que ``min_chars`` se juntan con la siguiente para no
+    mandar al TTS fragmentos sueltos ("Sí.", "Vale.") que suenan entrecortados.
+    """
+
+    def __init__(self, min_chars: int = STREAM_MIN_CHARS):
+        self.min_chars = min_chars
+        self._buf = ""
+
+    def feed(self, chunk: str) -> list[str]:
+        self._buf += chunk
+        out: list[str] = []
+        start = 0
+        for m in _SENTENCE_END.finditer(self._buf):
+            if m.end() - start < self.min_chars:
+                continue
+            out.append(self._buf[start:m.end()].strip())
+            start = m.end()
+        self._buf = self._buf[start:]
+        return [s for s in out if s]
+
+    def flush(self) -> list[str]:
+        rest, self._buf = self._buf.strip(), ""
+        return [rest] if rest else []
+
 PIPER_MODEL = os.getenv("PIPER_MODEL", "/var/lib/piper/models/es_ES-carlfm-x_low.onnx")
 PIPER_BIN   = os.getenv("PIPER_BIN", "/run/current-system/sw/bin/piper")
 PREFER_PIPER = os.getenv("PREFER_PIPER", "true").lower() in ("1","true","yes")
+PIPER_MODE   = os.getenv("PIPER_MODE", "auto").lower()
+PIPER_TIMEOUT = float(os.getenv("PIPER_TIMEOUT", "30"))
+DEBUG_AUDIO_DIR = os.getenv("TONTO_DEBUG_AUDIO_DIR", "")
+TTS_CACHE_DIR   = os.getenv("TONTO_TTS_CACHE_DIR", "/var/lib/tonto/tts-cache")
+TTS_CACHE_BYTES = int(os.getenv("TONTO_TTS_CACHE_BYTES", str(64 * 1024 * 1024)))
+ESPEAK_VOICE    = ("es", "140", "35")  # voz, velocidad, tono
+# pulse: pacat al servidor PulseAudio; null: descarta el audio tardando lo que
+# duraría sonar; discard: lo descarta al momento (pruebas de carga, bench/)
+AUDIO_SINK      = os.getenv("TONTO_AUDIO_SINK", "pulse").lower()
+
+def _pulse_server() -> str:
+    return os.getenv("PULSE_SERVER", "tcp:192.168.105.1:4713")
+
+class _PcmStream:
+    """Un único pacat en modo raw al que se va escribiendo el PCM que sale del TTS,
+    sin pasar por disco; las frases suenan seguidas y sin huecos entre ellas."""
+
+    def __init__(self):
+        self.proc: asyncio.subprocess.Process | None = None
+        self.fmt: tuple[int, int] | None = None
+
+    async def _open(self, rate: int, channels: int) -> None:
+        pacat = shutil.which("pacat") or "/run/current-system/sw/bin/pacat"
+        self.proc = await asyncio.create_subprocess_exec(
+            pacat, f"--server={_pulse_server()}", "--playback", "--raw",
+            "--format=s16le", f"--rate={rate}", f"--channels={channels}",
+            stdin=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        self.fmt = (rate, channels)
+
+    async def write(self, pcm: bytes, rate: int, channels: int = 1) -> None:
+        if (rate, channels) != self.fmt:
+            await self.close()
+            await self._open(rate, channels)
+        self.proc.stdin.write(pcm)
+        await self.proc.stdin.drain()
+
+    def kill(self) -> None:
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.kill()
+
+    async def close(self, check: bool = True) -> None:
+        proc, self.proc, self.fmt = self.proc, None, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+        except Exception:
+            pass
+        err = await proc.stderr.read()
+        rc = await proc.wait()
+        if check and rc != 0:
+            raise RuntimeError(f"pacat falló (rc={rc}): {err.decode('utf-8', 'ignore').strip()}")
+
+class _NullSink:
+    """Mismo interfaz que ``_PcmStream`` sin altavoz. Con ``paced`` cada
+    ``write`` tarda lo que dura el audio, como pacat cuando se le llena el
+    búfer, así que el planificador sigue siendo el cuello de botella real."""
+
+    def __init__(self, paced: bool = True):
+        self.paced = paced
+        self._killed = asyncio.Event()
+
+    async def write(self, pcm: bytes, rate: int, channels: int = 1) -> None:
+        if self.paced and not self._killed.is_set():
+            try:
+                await asyncio.wait_for(self._killed.wait(), len(pcm) / (2 * channels * rate))
+            except asyncio.TimeoutError:
+                pass
+
+    def kill(self) -> None:
+        self._killed.set()
+
+    async def close(self, check: bool = True) -> None:
+        pass
+
+def _make_sink() -> "_PcmStream | _NullSink":
+    if AUDIO_SINK in ("null", "discard"):
+        return _NullSink(paced=AUDIO_SINK == "null")
+    return _PcmStream()
+
+def _write_wav(pcm: bytes, rate: int, path: str) -> None:
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1); wf.setsampwidth(2); wf.setframerate(rate)
+        wf.writeframes(pcm)
+
+def _debug_dump(pcm: bytes, rate: int, engine: str) -> None:
+    """Solo con TONTO_DEBUG_AUDIO_DIR: guarda una copia WAV de lo sintetizado."""
+    if not DEBUG_AUDIO_DIR:
+        return
+    try:
+        os.makedirs(DEBUG_AUDIO_DIR, exist_ok=True)
+        _write_wav(pcm, rate, os.path.join(DEBUG_AUDIO_DIR, f"{time.time_ns()}-{engine}.wav"))
+    except Exception as e:
+        print(f"[tonto] debug audio: {e}", flush=True)
+
+def _piper_sample_rate(model: str) -> int:
+    try:
+        with open(model + ".json", "r", encoding="utf-8") as f:
+            return int(json.load(f)["audio"]["sample_rate"])
+    except Exception:
+        return 22050
+
+class PiperEngine:
+    """Motor Piper residente: carga el modelo de voz una sola vez y lo mantiene
+    caliente durante toda la vida del servicio.
+
+    Modos, por orden de preferencia (``PIPER_MODE=auto`` elige el primero que
+    funcione al arrancar):
+
+    * ``inprocess``: ``piper.PiperVoice`` (ONNX dentro de este proceso).
+    * ``resident``: un único ``piper --output_raw`` alimentado por stdin, una
+      línea por frase; el fin de cada frase se detecta por la línea
+      ``Real-time factor`` que el CLI escribe en stderr tras volcar el audio.
+    * ``oneshot``: un proceso por frase, como antes, pero con el flag de salida
+      ya averiguado al arrancar en vez de probar los tres en cada petición.
+    """
+
+    _DONE_MARK = b"Real-time factor"
+
+    def __init__(self, bin_path: str, model: str, mode: str = "auto", timeout: float = 30.0):
+        self.bin = bin_path
+        self.model = model
+        self.want_mode = mode
+        self.timeout = timeout
+        self.rate = _piper_sample_rate(model)
+        self.mode: str | None = None
+        self.out_flag: str | None = None
+        self._voice = None
+        self._proc: subprocess.Popen | None = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self.mode is not None:
+                return
+            if not os.path.exists(self.model):
+                raise RuntimeError(f"Modelo Piper no encontrado en {self.model}")
+            if self.want_mode in ("auto", "inprocess") and self._load_voice():
+                self.mode = "inprocess"
+            else:
+                if not os.path.exists(self.bin):
+                    raise RuntimeError(f"piper no encontrado en {self.bin}")
+                help_text = self._probe_help()
+                if self.want_mode in ("auto", "resident") and "output_raw" in help_text.replace("-", "_"):
+                    self._spawn()
+                    self.mode = "resident"
+                else:
+                    self.out_flag = "--output_file" if not help_text else None
+                    for flag in ("--output_file", "--output"):
+                        if re.search(re.escape(flag) + r"\b(?!-)", help_text):
+                            self.out_flag = flag
+                            break
+                    self.mode = "oneshot"
+        self._synthesize("Hola.")  # calienta el grafo ONNX antes de la primera petición real
+        print(f"[tonto] piper listo: modo={self.mode} flag={self.out_flag} rate={self.rate}", flush=True)
+
+    def _load_voice(self) -> bool:
+        try:
+            from piper import PiperVoice
+        except Exception:
+            return False
+        try:
+            self._voice = PiperVoice.load(self.model)
+        except Exception as e:
+            print(f"[tonto] PiperVoice no pudo cargar {self.model}: {e}", flush=True)
+            return False
+        cfg = getattr(self._voice, "config", None)
+        self.rate = int(getattr(cfg, "sample_rate", self.rate))
+        return True
+
+    def _probe_help(self) -> str:
+        try:
+            cp = subprocess.run([self.bin, "--help"], capture_output=True, timeout=10)
+        except Exception:
+            return ""
+        return ((cp.stdout or b"") + (cp.stderr or b"")).decode("utf-8", "ignore")
+
+    def _spawn(self) -> None:
+        self._proc = subprocess.Popen(
+            [self.bin, "--model", self.model, "--output_raw"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0,
+        )
+
+    def synthesize_pcm(self, text: str) -> bytes:
+        """Texto → PCM s16le mono a ``self.rate`` Hz."""
+        if self.mode is None:
+            self.start()
+        return self._synthesize(text)
+
+    def _synthesize(self, text: str) -> bytes:
+        with self._lock:
+            if self.mode == "inprocess":
+                return self._synth_inprocess(text)
+            if self.mode == "resident":
+                try:
+                    return self._synth_resident(text)
+                except Exception:
+                    self._restart()
+                    raise
+            return self._synth_oneshot(text)
+
+    def _synth_inprocess(self, text: str) -> bytes:
+        voice = self._voice
+        if hasattr(voice, "synthesize_stream_raw"):  # piper-tts <= 1.2
+            return b"".join(voice.synthesize_stream_raw(text))
+        return b"".join(chunk.audio_int16_bytes for chunk in voice.synthesize(text))
 
-def _play_wav(path: str) -> None:
-    server = os.getenv("PULSE_SERVER", "tcp:192.168.105.1:4713")
-    paplay = shutil.which("paplay") or "/run/current-system/sw/bin/paplay"
-    cp = subprocess.run([paplay, f"--server={server}", path], capture_output=True, text=True)
-    if cp.returncode != 0:
-        raise RuntimeError(f"paplay falló (rc={cp.returncode}): {cp.stderr.strip() or cp.stdout.strip()}")
+    def _synth_resident(self, text: str) -> bytes:
+        proc = self._proc
+        if proc is None or proc.poll() is not None:
+            self._spawn()
+            proc = self._proc
+        line = " ".join(text.split()) + "\n"
+        proc.stdin.write(_to_bytes(line))
+        proc.stdin.flush()
+
+        out_fd, err_fd = proc.stdout.fileno(), proc.stderr.fileno()
+        pcm = bytearray()
+        err = b""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise RuntimeError(f"piper no respondió en {self.timeout:.0f}s")
+            ready, _, _ = select.select([out_fd, err_fd], [], [], left)
+            if out_fd in ready:
+                data = os.read(out_fd, 65536)
+                if not data:
+                    raise RuntimeError(f"piper terminó (rc={proc.poll()}) err={err.decode('utf-8', 'ignore').strip()}")
+                pcm += data
+            if err_fd in ready:
+                err += os.read(err_fd, 4096)
+                if self._DONE_MARK in err:
+                    break
+        # el audio se escribe antes que la marca; vaciamos lo que quede en la tubería
+        while select.select([out_fd], [], [], 0)[0]:
+            data = os.read(out_fd, 65536)
+            if not data:
+                break
+            pcm += data
+        if len(pcm) % 2:
+            pcm = pcm[:-1]
+        return bytes(pcm)
+
+    def _synth_oneshot(self, text: str) -> bytes:
+        payload = _to_bytes(text)
+        tmpd = tempfile.mkdtemp()
+        try:
+            if self.out_flag:
+                wav = os.path.join(tmpd, "out.wav")
+                cp = subprocess.run([self.bin, "--model", self.model, self.out_flag, wav],
+                                    input=payload, capture_output=True, text=False)
+            else:
+                cp = subprocess.run([self.bin, "--model", self.model],
+                                    input=payload, cwd=tmpd, capture_output=True, text=False)
+                wav = self._find_wav(tmpd, cp)
+            if cp.returncode != 0 or not wav or not os.path.exists(wav):
+                raise RuntimeError(f"Piper no generó WAV (rc={cp.returncode}) err={(cp.stderr or b'').decode('utf-8','ignore').strip()}")
+            with wave.open(wav, "rb") as wf:
+                self.rate = wf.getframerate()
+                return wf.readframes(wf.getnframes())
+        finally:
+            shutil.rmtree(tmpd, ignore_errors=True)
+
+    @staticmethod
+    def _find_wav(cwd: str, cp: subprocess.CompletedProcess) -> str | None:
+        candidates = sorted(Path(cwd).glob("*.wav"), key=lambda p: p.stat().st_mtime, reverse=True)
+        if candidates:
+            return str(candidates[0])
+        out = (cp.stdout or b"").decode("utf-8", "ignore") + "\n" + (cp.stderr or b"").decode("utf-8", "ignore")
+        m = re.search(r"(/.*?\.wav)", out)
+        return m.group(1) if m else None
+
+    def _restart(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is not None:
+            try: proc.kill()
+            except Exception: pass
+
+    def info(self) -> dict:
+        return {
+            "mode": self.mode,
+            "output_flag": self.out_flag,
+            "sample_rate": self.rate,
+            "pid": self._proc.pid if self._proc and self._proc.poll() is None else None,
+        }
 
-def synthesize_piper(text: str) -> str:
-    if not os.path.exists(PIPER_BIN):
-        raise RuntimeError(f"piper no encontrado en {PIPER_BIN}")
+    def close(self) -> None:
+        with self._lock:
+            proc, self._proc = self._proc, None
+        if proc is not None:
+            try:
+                proc.stdin.close()
+                proc.wait(timeout=2)
+            except Exception:
+                proc.kill()
+
+_PIPER = PiperEngine(PIPER_BIN, PIPER_MODEL, PIPER_MODE, PIPER_TIMEOUT)
+
+def synthesize_piper(text: str) -> tuple[bytes, int]:
     if not os.path.exists(PIPER_MODEL):
         raise RuntimeError(f"Modelo Piper no encontrado en {PIPER_MODEL}")
+    pcm = _PIPER.synthesize_pcm(text)
+    if not pcm:
+        raise RuntimeError("Piper no generó audio")
+    _debug_dump(pcm, _PIPER.rate, "piper")
+    return pcm, _PIPER.rate
 
-    payload = _to_bytes(text)
-    tmpd = tempfile.mkdtemp()
-    wav = os.path.join(tmpd, "out.wav")
-
-    cp = subprocess.run(
-        [PIPER_BIN, "--model", PIPER_MODEL, "--output_file", wav],
-        input=payload, capture_output=True, text=False
-    )
-    if cp.returncode == 0 and os.path.exists(wav):
-        return wav
-
-    cp = subprocess.run(
-        [PIPER_BIN, "--model", PIPER_MODEL, "--output", wav],
-        input=payload, capture_output=True, text=False
-    )
-    if cp.returncode == 0 and os.path.exists(wav):
-        return wav
-
-    cwd = Path(tmpd)
-    cp = subprocess.run(
-        [PIPER_BIN, "--model", PIPER_MODEL],
-        input=payload, cwd=str(cwd), capture_output=True, text=False
-    )
-    candidates = sorted(cwd.glob("*.wav"), key=lambda p: p.stat().st_mtime, reverse=True)
-    if candidates:
-        return str(candidates[0])
-
-    out = (cp.stdout or b"").decode("utf-8", "ignore") + "\n" + (cp.stderr or b"").decode("utf-8", "ignore")
-    m = re.search(r"(/.*?\.wav)", out)
-    if m and os.path.exists(m.group(1)):
-        return m.group(1)
-
-    raise RuntimeError(f"Piper no generó WAV (rc={cp.returncode}) err={(cp.stderr or b'').decode('utf-8','ignore').strip()}")
-
-def synthesize_espeak(text: str) -> str:
+def synthesize_espeak(text: str) -> tuple[bytes, int]:
     espeak = shutil.which("espeak-ng") or "/run/current-system/sw/bin/espeak-ng"
-    tmpd = tempfile.mkdtemp()
-    wav = os.path.join(tmpd, "out.wav")
-    subprocess.run([espeak, "-v", "es", "-s", "140", "-p", "35", "-w", wav, text], check=True)
-    return wav
+    voice, speed, pitch = ESPEAK_VOICE
+    cp = subprocess.run([espeak, "-v", voice, "-s", speed, "-p", pitch, "--stdout", text],
+                        capture_output=True, check=True)
+    with wave.open(io.BytesIO(cp.stdout), "rb") as wf:
+        rate = wf.getframerate()
+        pcm = wf.readframes(wf.getnframes())
+    _debug_dump(pcm, rate, "espeak")
+    return pcm, rate
+
+class AudioCache:
+    """Caché en disco del audio sintetizado, direccionada por contenido.
+
+    La clave es el hash de (motor, voz, texto normalizado); cada entrada es un
+    WAV en ``root``. El orden LRU se guarda en memoria y en el mtime de los
+    ficheros, así que sobrevive a reinicios. Cuando el total supera
+    ``max_bytes`` se borran las entradas menos usadas. ``max_bytes <= 0`` la
+    desactiva.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._index: OrderedDict[str, int] = OrderedDict()  # clave → bytes, de menos a más reciente
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.enabled = max_bytes > 0
+        if self.enabled:
+            try:
+                self._load()
+            except OSError as e:
+                print(f"[tonto] caché TTS desactivada ({root}): {e}", flush=True)
+                self.enabled = False
+
+    @staticmethod
+    def key(text: str, engine: str, voice: str) -> str:
+        norm = " ".join(unicodedata.normalize("NFC", text).split())
+        return hashlib.sha256(f"{engine}\0{voice}\0{norm}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key + ".wav")
+
+    def _load(self) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".wav") and entry.is_file():
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._bytes += size
+        with self._lock:
+            self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        while self._bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
+
+    def get(self, key: str) -> tuple[bytes, int] | None:
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+        path = self._path(key)
+        try:
+            with wave.open(path, "rb") as wf:
+                clip = wf.readframes(wf.getnframes()), wf.getframerate()
+            os.utime(path)
+        except (OSError, EOFError, wave.Error):
+            with self._lock:
+                self._bytes -= self._index.pop(key, 0)
+            return None
+        return clip
+
+    def note(self, hit: bool) -> None:
+        """Cuenta una búsqueda. La cuenta quien llama: una por síntesis aunque pruebe varios motores."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, key: str, pcm: bytes, rate: int) -> None:
+        if not self.enabled or len(pcm) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            _write_wav(pcm, rate, tmp)
+            os.replace(tmp, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"[tonto] caché TTS: no se pudo guardar: {e}", flush=True)
+            return
+        with self._lock:
+            self._bytes += size - self._index.pop(key, 0)
+            self._index[key] = size
+            self._evict_locked()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "dir": self.root,
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+_TTS_CACHE = AudioCache(TTS_CACHE_DIR, TTS_CACHE_BYTES)
 
 @app.post("/ask")
 async def ask(body: AskBody):
     try:
-        answer = _ask_text(body.question, body.system)
-        return {"answer": answer}
+        hit = _match_intent(body.question)
+        if hit:
+            answer = await _run_intent(hit, body.question, body.session)
+            if answer is not None:
+                return {"answer": answer, "usage": {}, "path": f"intent:{hit[0].name}"}
+        answer, usage = await _ask(body.question, body.system, body.session)
+        _ANSWER_PATHS.labels("llm").inc()
+        return {"answer": answer, "usage": usage, "path": "llm"}
     except Exception as e:
+        _count_error("ask", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+def _cached_synth(engine: str, text: str) -> tuple[tuple[bytes, int], bool]:
+    if engine == "piper":
+        voice, synth = os.path.basename(PIPER_MODEL), synthesize_piper
+    else:
+        voice, synth = "-".join(ESPEAK_VOICE), synthesize_espeak
+    key = AudioCache.key(text, engine, voice)
+    clip = _TTS_CACHE.get(key)
+    if clip is not None:
+        return clip, True
+    t = time.perf_counter()
+    clip = synth(text)
+    _observe("tts", time.perf_counter() - t)
+    _TTS_CACHE.put(key, *clip)
+    return clip, False
+
+def _synthesize(text: str) -> tuple[str, tuple[bytes, int], bool]:
+    """Devuelve (motor, (pcm, rate), acierto_de_caché)."""
+    try:
+        engine, (clip, hit) = "piper", _cached_synth("piper", text)
+    except Exception as e:
+        if PREFER_PIPER:
+            raise
+        _count_error("piper", e)
+        _TTS_FALLBACKS.inc()
+        engine, (clip, hit) = "espeak", _cached_synth("espeak", text)
+    # Una búsqueda por petición: si piper falla y se pasa a espeak, cuenta lo que se sirvió
+    _TTS_CACHE.note(hit)
+    _CACHE_LOOKUPS.labels("tts", "hit" if hit else "miss").inc()
+    return engine, clip, hit
+
+async def _synthesize_async(text: str) -> tuple[str, tuple[bytes, int], bool]:
+    # El TTS (piper residente, espeak, lectura de caché) es bloqueante: va al pool
+    # de hilos, cuyo tamaño es el límite de concurrencia de esta etapa.
+    return await asyncio.get_running_loop().run_in_executor(_TTS_POOL, _synthesize, text)
+
+class _CueBank:
+    """Frases de relleno sintetizadas una vez al arrancar (de la caché de TTS tras
+    el primer arranque) y guardadas como PCM: sonar una no espera al TTS."""
+
+    def __init__(self, phrases: list[str]):
+        self.phrases = phrases
+        self.clips: list[tuple[bytes, int]] = []
+        self._next = 0
+
+    async def load(self) -> None:
+        if FILLER_AFTER_MS <= 0:
+            return
+        for text in self.phrases:
+            try:
+                _, clip, _ = await _synthesize_async(text)
+                self.clips.append(clip)
+            except Exception as e:
+                print(f"[tonto] aviso: relleno '{text}' no sintetizado: {e}", flush=True)
+
+    def filler(self) -> tuple[bytes, int] | None:
+        if not self.clips:
+            return None
+        clip = self.clips[self._next % len(self.clips)]
+        self._next += 1
+        return clip
+
+_CUES = _CueBank(FILLER_PHRASES)
+
+async def _filler_after(job: "SpeakJob") -> None:
+    """Relleno si el LLM no ha dado audio a tiempo y el altavoz ya espera a este
+    trabajo (si aún suena la respuesta anterior, no hace falta)."""
+    await asyncio.sleep(FILLER_AFTER_MS / 1000)
+    if _SPEAK.playing is not job or job.cancelled or "first_audio_ms" in job.timings or not job.audio.empty():
+        return
+    clip = _CUES.filler()
+    if clip is not None:
+        job.filler = clip
+        _FILLERS.inc()
+        job.audio.put_nowait(clip)
+
+def _ms_since(t0: float) -> int:
+    return int((time.perf_counter() - t0) * 1000)
+
+class SpeakJob:
+    """Una petición a /speak: la preparan los workers (LLM + TTS, que dejan el
+    audio en ``audio``) y la reproduce el planificador, en orden de llegada."""
+
+    def __init__(self, body: AskBody, held: bool = False):
+        self.id = uuid.uuid4().hex[:12]
+        self.question = body.question
+        self.session = body.session
+        self.system = body.system
+        self.stream = STREAM_DEFAULT if body.stream is None else body.stream
+        self.source = body.source
+        self.intent = _match_intent(body.question)
+        self.state = "queued"  # queued → running → playing → done | error | cancelled
+        self.created = time.perf_counter()
+        self.audio: asyncio.Queue = asyncio.Queue()  # (pcm, rate) …, None al terminar
+        self.finished = asyncio.Event()
+        self.cancelled = False
+        self.error: str | None = None
+        self.result: dict = {}
+        self.timings: dict[str, int] = {}
+        self.task: asyncio.Task | None = None
+        # Especulativo (/ingest): se prepara ya, pero no suena ni entra en el
+        # historial hasta que ``commit`` lo confirma con el texto final
+        self.release = asyncio.Event()
+        if not held:
+            self.release.set()
+        self.turn: str | None = None
+        self.speculation: str | None = None
+        self.filler: tuple[bytes, int] | None = None  # relleno puesto en ``audio``, si lo hubo
+
+    def remember(self, answer: str) -> None:
+        if self.release.is_set():
+            _remember(self.question, answer, self.session)
+        else:
+            self.turn = answer
+
+    def commit(self, question: str) -> None:
+        self.question = question
+        self.mark("final_ms")
+        if self.turn is not None:
+            _remember(question, self.turn, self.session)
+            self.turn = None
+        self.release.set()
+
+    def mark(self, name: str) -> None:
+        self.timings.setdefault(name, _ms_since(self.created))
+
+    def finish(self, state: str) -> None:
+        if self.finished.is_set():
+            return
+        self.state = state
+        self.timings["total_ms"] = _ms_since(self.created)
+        self.finished.set()
+
+    def snapshot(self) -> dict:
+        return {"job": self.id, "state": self.state, "question": self.question, "stream": self.stream,
+                "source": self.source, **self.result, "error": self.error, "timings": self.timings,
+                **({"speculation": self.speculation} if self.speculation else {})}
+
+class _SpeakScheduler:
+    """Cola acotada de trabajos /speak, workers que los preparan y un único
+    planificador de reproducción dueño del altavoz (permite cortar — barge‑in)."""
+
+    def __init__(self, queue_size: int, workers: int, kept: int):
+        self.pending: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.order: asyncio.Queue = asyncio.Queue()  # mismo orden de admisión, para reproducir
+        self.jobs: OrderedDict[str, SpeakJob] = OrderedDict()
+        self.n_workers = workers
+        self.kept = kept
+        self.playing: SpeakJob | None = None
+        self.sink: _PcmStream | _NullSink | None = None
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.n_workers)]
+        self._tasks.append(asyncio.create_task(self._player()))
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def submit(self, body: AskBody, held: bool = False) -> SpeakJob:
+        job = SpeakJob(body, held)
+        self.pending.put_nowait(job)  # QueueFull si la cola está llena
+        self.order.put_nowait(job)
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.kept:
+            oldest = next(iter(self.jobs.values()))
+            if not oldest.finished.is_set():
+                break
+            self.jobs.popitem(last=False)
+        return job
+
+    def cancel(self, job: SpeakJob) -> None:
+        if job.finished.is_set():
+            return
+        job.cancelled = True
+        job.release.set()
+        if job.task is not None:
+            job.task.cancel()
+        if self.playing is job and self.sink is not None:
+            self.sink.kill()
+        if self.playing is not job:
+            job.finish("cancelled")
+
+    def barge_in(self, everything: bool = False) -> list[str]:
+        targets = [j for j in self.jobs.values() if not j.finished.is_set()]
+        if not everything:
+            targets = [self.playing] if self.playing is not None else []
+        for job in targets:
+            self.cancel(job)
+        return [j.id for j in targets]
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self.pending.get()
+            if job.cancelled:
+                continue
+            job.state = "running"
+            job.mark("queued_ms")
+            job.task = asyncio.create_task(_produce_intent(job) if job.intent
+                                           else _produce_streaming(job) if job.stream else _produce_full(job))
+            filler = asyncio.create_task(_filler_after(job)) if FILLER_AFTER_MS > 0 and not job.intent else None
+            try:
+                await job.task
+            except asyncio.CancelledError:
+                if not job.cancelled:
+                    raise
+            except Exception as e:
+                _count_error("speak", e)
+                job.error = str(e)
+            finally:
+                if filler is not None:
+                    filler.cancel()
+                job.audio.put_nowait(None)
+
+    async def _player(self) -> None:
+        while True:
+            job = await self.order.get()
+            await job.release.wait()  # especulativo: hasta que /ingest lo confirme o lo cancele
+            if job.cancelled:
+                job.finish("cancelled")
+                continue
+            sink = _make_sink()
+            self.playing, self.sink = job, sink
+            t_play = None
+            try:
+                while (clip := await job.audio.get()) is not None and not job.cancelled:
+                    if job.state != "playing":
+                        job.state = "playing"
+                    if clip is job.filler:
+                        job.mark("filler_ms")  # el relleno no es la respuesta: no cuenta para first_audio_ms
+                    elif t_play is None:
+                        job.mark("first_audio_ms")
+                        t_play = time.perf_counter()
+                    await sink.write(*clip)
+                if job.cancelled:
+                    sink.kill()
+                await sink.close(check=not job.cancelled)
+                if t_play is not None and not job.cancelled:
+                    _observe("playback", time.perf_counter() - t_play)
+            except Exception as e:
+                if not job.cancelled:
+                    _count_error("audio", e)
+                    job.error = job.error or f"Error audio: {e}"
+                sink.kill()
+                await sink.close(check=False)
+            finally:
+                self.playing, self.sink = None, None
+            job.finish("cancelled" if job.cancelled else "error" if job.error else "done")
+
+_SPEAK = _SpeakScheduler(SPEAK_QUEUE_SIZE, SPEAK_WORKERS, SPEAK_JOBS_KEPT)
+Gauge("tonto_speak_queue_depth", "Trabajos /speak esperando worker").set_function(lambda: _SPEAK.pending.qsize())
+Gauge("tonto_speak_playing", "1 mientras suena una respuesta").set_function(lambda: _SPEAK.playing is not None)
+
+async def _produce_intent(job: SpeakJob) -> None:
+    """Intención local: el texto sale del handler y va directo al TTS."""
+    answer = await _run_intent(job.intent, job.question, job.session, job)
+    if answer is None:  # el handler la deja pasar
+        job.intent = None
+        return await (_produce_streaming(job) if job.stream else _produce_full(job))
+    job.mark("intent_ms")
+    text = _clean_for_tts(answer)
+    job.result = {"engine": None, "answer": text, "cache_hits": 0, "usage": {},
+                  "path": f"intent:{job.intent[0].name}"}
+    if text:
+        t = time.perf_counter()
+        engine, clip, cached = await _synthesize_async(text)
+        job.timings["tts_ms"] = _ms_since(t)
+        job.result.update(engine=engine, cache_hits=int(cached))
+        job.audio.put_nowait(clip)
+
+async def _produce_full(job: SpeakJob) -> None:
+    text, usage = await _vertex_generate(await _build_request(job.question, job.system, job.session))
+    job.remember(text)
+    _ANSWER_PATHS.labels("llm").inc()
+    job.mark("llm_ms")
+    if not text:
+        raise RuntimeError("Respuesta vacía del modelo")
+    text = _clean_for_tts(text)
+
+    t = time.perf_counter()
+    engine, clip, cached = await _synthesize_async(text)
+    job.timings["tts_ms"] = _ms_since(t)
+    job.result = {"engine": engine, "answer": text, "cache_hits": int(cached), "usage": usage, "path": "llm"}
+    job.audio.put_nowait(clip)
+
+async def _produce_streaming(job: SpeakJob) -> None:
+    """LLM en streaming → frases → TTS, solapados; el audio de cada frase pasa
+    al planificador en cuanto está listo, mientras se generan las siguientes.
+
+    Esta corrutina consume los tokens y trocea frases; una tarea sintetiza cada
+    frase en cuanto está completa.
+    """
+    sentences: asyncio.Queue = asyncio.Queue()
+    engines: list[str] = []
+    tts_ms = 0
+    cache_hits = 0
+
+    async def tts_stage():
+        nonlocal tts_ms, cache_hits
+        while (sentence := await sentences.get()) is not None:
+            t = time.perf_counter()
+            engine, clip, cached = await _synthesize_async(sentence)
+            tts_ms += _ms_since(t)
+            cache_hits += cached
+            job.mark("first_tts_ms")
+            engines.append(engine)
+            job.audio.put_nowait(clip)
+
+    tts = asyncio.create_task(tts_stage())
+    splitter = _SentenceSplitter()
+    answer: list[str] = []
+    spoken: list[str] = []
+    usage: dict = {}
+
+    def enqueue(batch: list[str]) -> None:
+        for sentence in batch:
+            sentence = _clean_for_tts(sentence)
+            if sentence:
+                job.mark("first_sentence_ms")
+                spoken.append(sentence)
+                sentences.put_nowait(sentence)
+
+    try:
+        request = await _build_request(job.question, job.system, job.session)
+        async with aclosing(_vertex_stream_text(request, usage)) as chunks:
+            async for chunk in chunks:
+                job.mark("first_token_ms")
+                answer.append(chunk)
+                enqueue(splitter.feed(chunk))
+                if tts.done():
+                    break  # el TTS ha fallado; el await de abajo propaga el error
+        enqueue(splitter.flush())
+        job.mark("llm_ms")
+    except BaseException:
+        tts.cancel()
+        raise
+    finally:
+        sentences.put_nowait(None)
+    await tts
+
+    text = "".join(answer).strip()
+    if not text:
+        raise RuntimeError("Respuesta vacía del modelo")
+    job.remember(text)
+    _ANSWER_PATHS.labels("llm").inc()
+
+    job.timings["tts_ms"] = tts_ms
+    engine = "piper" if all(e == "piper" for e in engines) else "espeak"
+    job.result = {"engine": engine, "answer": " ".join(spoken), "sentences": len(spoken),
+                  "cache_hits": cache_hits, "usage": usage, "path": "llm"}
+
+def _get_job(job_id: str) -> SpeakJob:
+    job = _SPEAK.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo desconocido: {job_id}")
+    return job
+
+async def _speak_reply(job: SpeakJob, wait: bool) -> dict:
+    if not wait:
+        return {"ok": True, "job": job.id, "state": job.state,
+                **({"speculation": job.speculation} if job.speculation else {})}
+
+    await job.finished.wait()
+    if job.state == "error":
+        raise HTTPException(status_code=500, detail=job.error)
+    return {"ok": job.state == "done", "spoken": job.state == "done", **job.snapshot()}
+
 @app.post("/speak")
 async def speak(body: AskBody):
     try:
-        text = _ask_text(body.question, body.system)
-        if not text:
-            raise RuntimeError("Respuesta vacía del modelo")
-
-        text = re.sub(r"<[^>]+>", "", text)  # remove HTML tags
-        text = re.sub(r"\[/?[a-z]+\]", "", text)  # remove [user] and [/user] tags
-        text = re.sub(r"#\w+", "", text)  # remove hashtags
-        text = re.sub(r"\s+", " ", text).strip()  # normalize whitespace
-        text = text.replace("\n", " ")  # replace newlines with spaces
-        text = text.replace("*", " ").replace("_", " ")  # replace * and _ with spaces
-
-        engine = "piper"
+        job = _SPEAK.submit(body)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=429, detail="Cola de /speak llena")
+    return await _speak_reply(job, body.wait)
+
+async def _ndjson(request: Request):
+    """Objetos JSON de un cuerpo NDJSON según van llegando (HTTP chunked)."""
+    buf = b""
+    async for chunk in request.stream():
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _ndjson_object(line)
+    if buf.strip():
+        yield _ndjson_object(buf)
+
+def _ndjson_object(line: bytes) -> dict:
+    try:
+        msg = json.loads(line)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"NDJSON inválido: {e}")
+    if not isinstance(msg, dict):
+        raise HTTPException(status_code=400, detail="Cada línea de /ingest debe ser un objeto JSON")
+    for key in ("partial", "final"):
+        if msg.get(key) is not None and not isinstance(msg[key], str):
+            raise HTTPException(status_code=400, detail=f"'{key}' debe ser texto")
+    return msg
+
+def _ingest_body(fields: dict) -> AskBody:
+    """Los campos de /ingest validados como en /speak (422) antes de encolar nada."""
+    try:
+        return AskBody(**fields, question="")
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
+def _same_command(a: str, b: str) -> bool:
+    return _normalize_command(a) == _normalize_command(b)
+
+def _looks_complete(partial: str, eos: bool) -> bool:
+    """Parcial con la que merece la pena arrancar el LLM: bastantes palabras y
+    fin de habla o puntuación final de Whisper."""
+    return len(partial.split()) >= SPECULATE_MIN_WORDS and (eos or partial.endswith((".", "?", "!")))
+
+@app.post("/ingest")
+async def ingest(request: Request):
+    """/speak alimentado por el STT en streaming. Cuerpo NDJSON (chunked): los
+    campos de ``AskBody`` en cualquier línea, ``{"partial": …, "eos": bool}``
+    según se confirman palabras y ``{"final": …}`` (o ``{"cancel": true}``).
+
+    Una parcial que parece completa arranca un trabajo especulativo retenido;
+    con el texto final se confirma si es el mismo comando o se cancela y se
+    encola uno normal, como haría /speak."""
+    fields: dict = {}
+    body = _ingest_body(fields)
+    spec: SpeakJob | None = None
+    final: str | None = None
+    tries = 0
+    try:
+        async for msg in _ndjson(request):
+            fields.update((k, v) for k, v in msg.items() if k in AskBody.model_fields and k != "question")
+            body = _ingest_body(fields)
+            if "final" in msg or msg.get("cancel"):
+                final = (msg.get("final") or "").strip()
+                break
+            partial = (msg.get("partial") or "").strip()
+            if (not SPECULATE or tries >= SPECULATE_MAX or not _looks_complete(partial, bool(msg.get("eos")))
+                    or (spec is not None and _same_command(spec.question, partial)) or _match_intent(partial)):
+                continue
+            if spec is not None:
+                _SPEAK.cancel(spec)
+            try:
+                spec = _SPEAK.submit(body.model_copy(update={"question": partial}), held=True)
+            except asyncio.QueueFull:
+                spec = None
+                continue
+            tries += 1
+    except (HTTPException, RequestValidationError):
+        if spec is not None:  # petición mal formada: no cuenta como especulación
+            _SPEAK.cancel(spec)
+        raise
+    except BaseException:
+        if spec is not None:  # cliente desconectado a mitad
+            _SPEAK.cancel(spec)
+        _SPECULATION.labels("aborted").inc()
+        raise
+
+    if not final:
+        if spec is not None:
+            _SPEAK.cancel(spec)
+        _SPECULATION.labels("aborted").inc()
+        return {"ok": True, "job": None, "speculation": "aborted"}
+
+    if spec is not None and not spec.cancelled and spec.error is None and _same_command(spec.question, final):
+        _SPEC_HEAD_START.observe(time.perf_counter() - spec.created)
+        spec.commit(final)
+        job, result = spec, "hit"
+    else:
+        if spec is not None:
+            _SPEAK.cancel(spec)
+        result = "miss" if spec is not None else "none"
         try:
-            wav = synthesize_piper(text)
-        except Exception as e:
-            if PREFER_PIPER:
-                raise
-            engine = "espeak"
-            wav = synthesize_espeak(text)
-
-        _play_wav(wav)
-        return {"ok": True, "spoken": True, "engine": engine, "answer": text}
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(status_code=500, detail=f"Error audio/TTS: {e}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+            job = _SPEAK.submit(body.model_copy(update={"question": final}))
+        except asyncio.QueueFull:
+            _SPECULATION.labels(result).inc()
+            raise HTTPException(status_code=429, detail="Cola de /speak llena")
+    job.speculation = result
+    _SPECULATION.labels(result).inc()
+    print(f"[tonto] /ingest: especulación {result} ({tries} intento/s)", flush=True)
+    return await _speak_reply(job, bool(fields.get("wait")))
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    return _get_job(job_id).snapshot()
+
+@app.post("/jobs/{job_id}/cancel")
+async def job_cancel(job_id: str):
+    job = _get_job(job_id)
+    _SPEAK.cancel(job)
+    return job.snapshot()
+
+@app.post("/barge-in")
+async def barge_in(all: bool = False):
+    return {"ok": True, "cancelled": _SPEAK.barge_in(everything=all)}
 
 @app.get("/tts-info")
 async def tts_info():
@@ -258,18 +1725,114 @@ async def tts_info():
         "PREFER_PIPER": PREFER_PIPER,
         "piper_exists": os.path.exists(PIPER_BIN),
         "model_exists": os.path.exists(PIPER_MODEL),
+        "engine": _PIPER.info(),
+        "cache": _TTS_CACHE.stats(),
+    }
+
+@app.get("/usage")
+async def usage():
+    return {
+        "tokens": _USAGE_TOTALS,
+        "context_cache": _SYSTEM_CACHE.stats(),
+        "history": _HISTORY.stats(),
     }
 
+HEALTH_INTERVAL = float(os.getenv("TONTO_HEALTH_INTERVAL", "30"))
+HEALTH_TIMEOUT  = float(os.getenv("TONTO_HEALTH_TIMEOUT", "5"))
+
+class HealthProber:
+    """Comprueba las dependencias en segundo plano y guarda el último resultado;
+    /health solo lee ese estado, nunca genera nada en línea."""
+
+    def __init__(self, interval: float, timeout: float):
+        self.interval = interval
+        self.timeout = timeout
+        self.checks: dict[str, dict] = {}
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.gather(
+                self._run("token", self._check_token),
+                self._run("vertex", self._check_vertex),
+                self._run("piper", self._check_piper),
+                self._run("pulse", self._check_pulse),
+            )
+            await asyncio.sleep(self.interval)
+
+    async def _run(self, name: str, check) -> None:
+        t = time.perf_counter()
+        try:
+            detail = await asyncio.wait_for(check(), self.timeout) or {}
+            ok, error = True, None
+        except Exception as e:
+            detail, ok, error = {}, False, str(e) or type(e).__name__
+            _count_error(f"probe_{name}", e)
+        took = time.perf_counter() - t
+        _observe(f"probe_{name}", took)
+        self.checks[name] = {"ok": ok, "error": error, "latency_ms": round(took * 1000, 1),
+                             "checked_at": int(time.time()), **detail}
+
+    async def _check_token(self) -> dict:
+        await asyncio.to_thread(_VERTEX.token)
+        return _VERTEX.token_state()
+
+    async def _check_vertex(self) -> dict:
+        # countTokens: comprueba alcance y credenciales sin generar (ni facturar) nada
+        resp = await _VERTEX.post(_COUNT_URL, _prompt_body("ping"))
+        if resp.status_code != 200:
+            raise RuntimeError(f"{resp.status_code} {resp.text[:200]}")
+        return {}
+
+    async def _check_piper(self) -> dict:
+        info = _PIPER.info()
+        if not os.path.exists(PIPER_MODEL):
+            raise RuntimeError(f"Modelo Piper no encontrado en {PIPER_MODEL}")
+        if info["mode"] is None:
+            raise RuntimeError("piper no arrancado")
+        if info["mode"] == "resident" and info["pid"] is None:
+            raise RuntimeError("proceso piper caído")
+        return {"mode": info["mode"]}
+
+    async def _check_pulse(self) -> dict:
+        if AUDIO_SINK != "pulse":
+            return {"sink": AUDIO_SINK}
+        pactl = shutil.which("pactl") or "/run/current-system/sw/bin/pactl"
+        proc = await asyncio.create_subprocess_exec(
+            pactl, f"--server={_pulse_server()}", "info",
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            _, err = await proc.communicate()
+        except asyncio.CancelledError:
+            proc.kill()
+            raise
+        if proc.returncode != 0:
+            raise RuntimeError(f"pactl rc={proc.returncode}: {err.decode('utf-8', 'ignore').strip()}")
+        return {}
+
+_HEALTH = HealthProber(HEALTH_INTERVAL, HEALTH_TIMEOUT)
+
+@app.get("/livez")
+async def livez():
+    return {"ok": True}
+
 @app.get("/health")
 async def health():
-    try:
-        sample = _vertex_generate_text("ping")
-        return {
-            "ok": True,
-            "sample": (sample or "")[:64],
-            "project": PROJECT,
-            "location": LOCATION,
-            "model": MODEL_ID
-        }
-    except Exception as e:
-        return {"ok": False, "error": str(e)}
+    checks = dict(_HEALTH.checks)
+    return {
+        "ok": bool(checks) and all(c["ok"] for c in checks.values()),
+        "project": PROJECT,
+        "location": LOCATION,
+        "model": MODEL_ID,
+        "checks": checks,
+        "latency": {name: w.summary() for name, w in sorted(_LATENCY.items())},
+    }
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""DSP vectorizado (NumPy) para el bucle de captura de hotword.py.
+
+Ganancia con recorte, RMS/pico y el pitido de wake, sin bucles por muestra.
+Los resultados son idénticos bit a bit a las versiones en Python puro que
+sustituyen (``python audio_dsp.py`` lo comprueba y mide el coste por trama).
+"""
+
+import math
+import numpy as np
+
+INT16_MIN, INT16_MAX = -32768, 32767
+
+def pcm_from_bytes(raw) -> np.ndarray:
+    """Vista int16 (s16le) sobre ``raw``, sin copiar."""
+    return np.frombuffer(raw, dtype="<i2")
+
+def apply_gain(pcm: np.ndarray, gain: float, out: np.ndarray | None = None) -> np.ndarray:
+    """``clamp_int16(int(v * gain))`` para cada muestra: producto en float64,
+    truncado hacia cero y recorte a int16."""
+    scaled = np.multiply(pcm, gain, dtype=np.float64)
+    np.trunc(scaled, out=scaled)
+    np.clip(scaled, INT16_MIN, INT16_MAX, out=scaled)
+    if out is None:
+        return scaled.astype(np.int16)
+    np.copyto(out, scaled, casting="unsafe")
+    return out
+
+def _sum_squares(pcm: np.ndarray) -> int:
+    # Enteros exactos (int64): la suma coincide con el acumulador float de la
+    # versión en Python mientras no pase de 2**53, es decir, millones de muestras.
+    x = pcm.astype(np.int64)
+    return int(np.dot(x, x))
+
+def _peak(pcm: np.ndarray) -> int:
+    return int(np.abs(pcm.astype(np.int32)).max())
+
+def vu(pcm) -> tuple[float, int]:
+    """(RMS, pico) de un bloque int16; acepta ndarray, ``array('h')`` o bytes."""
+    if not isinstance(pcm, np.ndarray):
+        pcm = pcm_from_bytes(pcm)
+    if pcm.size == 0:
+        return (0.0, 0)
+    return (math.sqrt(float(_sum_squares(pcm)) / pcm.size), _peak(pcm))
+
+def frame_rms(pcm: np.ndarray, frame: int) -> np.ndarray:
+    """RMS de cada trama completa de ``frame`` muestras (la cola incompleta se ignora)."""
+    n = pcm.size // frame
+    if n == 0:
+        return np.empty(0, dtype=np.float64)
+    x = pcm[:n * frame].reshape(n, frame).astype(np.int64)
+    return np.sqrt(np.einsum("ij,ij->i", x, x) / float(frame))
+
+class VuMeter:
+    """Acumula RMS/pico de varias tramas sin concatenarlas; ``take()`` devuelve
+    lo mismo que ``vu()`` sobre todas ellas juntas y reinicia."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.acc = 0
+        self.peak = 0
+        self.count = 0
+
+    def feed(self, pcm: np.ndarray) -> None:
+        if pcm.size:
+            self.acc += _sum_squares(pcm)
+            self.peak = max(self.peak, _peak(pcm))
+            self.count += pcm.size
+
+    def take(self) -> tuple[float, int]:
+        res = (math.sqrt(float(self.acc) / self.count), self.peak) if self.count else (0.0, 0)
+        self.reset()
+        return res
+
+def beep_pcm(hz=880, dur=0.12, rate=16000, vol=0.6) -> np.ndarray:
+    """Seno de ``hz`` Hz en int16, igual muestra a muestra que el bucle original."""
+    n = int(rate * dur)
+    t = np.arange(n) / float(rate)
+    s = vol * np.sin((2.0 * math.pi * hz) * t)
+    np.clip(s, -1.0, 1.0, out=s)
+    s *= 32767.0
+    return np.trunc(s).astype(np.int16)
+
+# --- micro‑benchmark: python audio_dsp.py -----------------------------------
+
+def _ref_clamp_int16(x: int) -> int:
+    if x > 32767: return 32767
+    if x < -32768: return -32768
+    return x
+
+def _ref_gain(pcm, gain):
+    from array import array
+    out = array('h', pcm)
+    for i, v in enumerate(out):
+        out[i] = _ref_clamp_int16(int(v * gain))
+    return out
+
+def _ref_vu(pcm):
+    if not pcm: return (0.0, 0)
+    acc = 0.0; peak = 0
+    for v in pcm:
+        av = abs(v); peak = max(peak, av); acc += float(v)*float(v)
+    return (math.sqrt(acc / len(pcm)), peak)
+
+def _ref_beep(hz=880, dur=0.12, rate=16000, vol=0.6):
+    n = int(rate * dur); frames = []
+    for i in range(n):
+        s = vol * math.sin(2.0 * math.pi * hz * (i / float(rate)))
+        frames.append(int(max(-1.0, min(1.0, s)) * 32767.0))
+    return frames
+
+def _bench(frames: int = 2000, frame_len: int = 512, gain: float = 2.0) -> None:
+    import timeit
+    from array import array
+    rng = np.random.default_rng(1234)
+    data = rng.integers(INT16_MIN, INT16_MAX + 1, size=(frames, frame_len), dtype=np.int16)
+    data[0, :4] = (INT16_MIN, INT16_MAX, 0, -1)
+    refs = [array('h', row.tobytes()) for row in data]
+
+    for row, ref in zip(data, refs):
+        assert apply_gain(row, gain).tobytes() == _ref_gain(ref, gain).tobytes(), "apply_gain difiere"
+        assert vu(row) == _ref_vu(ref), "vu difiere"
+    meter = VuMeter()
+    for row in data[:31]:
+        meter.feed(row)
+    assert meter.take() == _ref_vu(array('h', data[:31].tobytes())), "VuMeter difiere"
+    for args in ((880, 0.12, 16000, 0.6), (440, 0.5, 22050, 1.0), (1000, 0.2, 16000, 1.5)):
+        assert beep_pcm(*args).tolist() == _ref_beep(*args), f"beep_pcm{args} difiere"
+    print("[dsp] salidas idénticas bit a bit a la versión en Python", flush=True)
+
+    n = 200
+    rows = [data[i % frames] for i in range(n)]
+    ref_rows = [refs[i % frames] for i in range(n)]
+    def per_frame_us(fn, items):
+        it = iter(items * 10)
+        return min(timeit.repeat(lambda: fn(next(it)), number=n, repeat=5)) / n * 1e6
+    out = np.empty(frame_len, dtype=np.int16)
+    cases = [
+        ("gain", lambda r: _ref_gain(r, gain), lambda r: apply_gain(r, gain, out=out)),
+        ("rms+peak", _ref_vu, vu),
+    ]
+    fps = 16000 / frame_len
+    for name, ref_fn, np_fn in cases:
+        ref_us = per_frame_us(ref_fn, ref_rows)
+        np_us = per_frame_us(np_fn, rows)
+        print(f"[dsp] {name:9s} python={ref_us:8.1f}µs/trama  numpy={np_us:6.1f}µs/trama  "
+              f"x{ref_us / np_us:5.1f}  ({np_us * fps / 1e4:.3f}% de un núcleo a {fps:.2f} tramas/s)", flush=True)
+
+if __name__ == "__main__":
+    _bench()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Generador de carga para la API de tonto (``/ask`` y ``/speak``).
+
+Para cada nivel de concurrencia lanza ``--requests`` peticiones con tantos
+clientes a la vez y mide latencia (p50/p95/p99) y peticiones por segundo por
+endpoint. En ``/speak`` (con ``wait``) desglosa además las etapas con las
+``timings`` del trabajo: cola, primer token, LLM, TTS, primer audio y
+reproducción. Las respuestas de intenciones locales (``path`` ``intent:…``) no
+pasan por el LLM: se cuentan y miden aparte. Tras cada nivel guarda las ventanas de ``/health`` (token,
+vertex, tts, playback medidos en el servidor).
+
+Todo en local, sin cuota ni altavoz:
+
+    python bench/vertex_stub.py --port 8099 --latency 0.4 --jitter 0.1 --tokens-per-sec 40
+    GCP_PROJECT_ID=stub VERTEX_BASE_URL=http://127.0.0.1:8099 VERTEX_STATIC_TOKEN=stub \\
+        TONTO_AUDIO_SINK=null uvicorn app:app --port 8088
+    python bench/loadgen.py --url http://127.0.0.1:8088 --concurrency 1,4,16 --out load.json
+"""
+
+import argparse, asyncio, itertools, json, sys, time
+
+import httpx
+
+# Etapas de /speak a partir de SpeakJob.timings (ms desde la admisión)
+SPEAK_STAGES = {
+    "queued":      lambda t: t.get("queued_ms"),
+    "first_token": lambda t: t.get("first_token_ms"),
+    "llm":         lambda t: t.get("llm_ms"),
+    "tts":         lambda t: t.get("tts_ms"),
+    "first_audio": lambda t: t.get("first_audio_ms"),
+    "playback":    lambda t: t["total_ms"] - t["first_audio_ms"]
+                   if t.get("total_ms") is not None and t.get("first_audio_ms") is not None else None,
+}
+
+def percentiles(values: list) -> dict | None:
+    data = sorted(v for v in values if v is not None)
+    if not data:
+        return None
+    pick = lambda q: round(data[min(len(data) - 1, int(q * len(data)))], 1)
+    return {"n": len(data), "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": round(data[-1], 1)}
+
+async def one_request(http: httpx.AsyncClient, endpoint: str, question: str, session: str,
+                      stream: bool | None) -> dict:
+    body = {"question": question, "session": session}
+    if endpoint == "speak":
+        body["wait"] = True
+        if stream is not None:
+            body["stream"] = stream
+    t = time.perf_counter()
+    try:
+        r = await http.post(f"/{endpoint}", json=body)
+        status, data = r.status_code, (r.json() if r.headers.get("content-type", "").startswith("application/json") else {})
+    except httpx.HTTPError as e:
+        status, data = 0, {"detail": f"{type(e).__name__}: {e}"}
+    out = {"status": status, "ms": (time.perf_counter() - t) * 1000}
+    if status != 200:
+        out["error"] = str(data.get("detail", ""))[:200]
+    else:
+        out["path"] = data.get("path") or "llm"
+        if endpoint == "speak":
+            out["timings"] = data.get("timings") or {}
+    return out
+
+async def run_level(http: httpx.AsyncClient, endpoint: str, concurrency: int, total: int,
+                    questions: list, unique: bool, stream: bool | None) -> dict:
+    counter = itertools.count()
+    results = []
+
+    async def client(worker: int):
+        session = f"load-{endpoint}-{concurrency}-{worker}"
+        while (i := next(counter)) < total:
+            q = questions[i % len(questions)]
+            if unique:
+                q = f"{q} ({concurrency}.{i})"   # evita que la caché de TTS oculte el coste
+            results.append(await one_request(http, endpoint, q, session, stream))
+
+    t = time.perf_counter()
+    await asyncio.gather(*(client(w) for w in range(concurrency)))
+    wall = time.perf_counter() - t
+
+    ok = [r for r in results if r["status"] == 200]
+    llm = [r for r in ok if r["path"] == "llm"]
+    paths: dict[str, int] = {}
+    for r in ok:
+        paths[r["path"]] = paths.get(r["path"], 0) + 1
+    level = {
+        "endpoint": endpoint, "concurrency": concurrency, "requests": len(results),
+        "ok": len(ok), "rejected_429": sum(r["status"] == 429 for r in results),
+        "errors": len(results) - len(ok) - sum(r["status"] == 429 for r in results),
+        "wall_s": round(wall, 2), "rps": round(len(ok) / wall, 2) if wall else None,
+        "paths": paths, "latency_ms": percentiles([r["ms"] for r in llm]),
+    }
+    if len(llm) < len(ok):
+        level["intent_latency_ms"] = percentiles([r["ms"] for r in ok if r["path"] != "llm"])
+    if endpoint == "speak":
+        level["stages_ms"] = {name: percentiles([f(r["timings"]) for r in llm])
+                              for name, f in SPEAK_STAGES.items()}
+    samples = sorted({r["error"] for r in results if r.get("error")})
+    if samples:
+        level["error_samples"] = samples[:5]
+    return level
+
+def describe(level: dict) -> str:
+    lat = level["latency_ms"] or {}
+    line = (f"{level['endpoint']:5} c={level['concurrency']:<3} ok={level['ok']}/{level['requests']} "
+            f"rps={level['rps']}  p50={lat.get('p50')} p95={lat.get('p95')} p99={lat.get('p99')} ms")
+    for name, p in (level.get("stages_ms") or {}).items():
+        if p:
+            line += f"\n      {name:12} p50={p['p50']} p95={p['p95']} p99={p['p99']}"
+    if level.get("intent_latency_ms"):
+        p = level["intent_latency_ms"]
+        line += (f"\n      intents={sum(n for k, n in level['paths'].items() if k != 'llm')} "
+                 f"p50={p['p50']} p95={p['p95']} p99={p['p99']} (fuera de las cifras del LLM)")
+    if level["rejected_429"] or level["errors"]:
+        line += f"\n      429={level['rejected_429']} errores={level['errors']} {level.get('error_samples', '')}"
+    return line
+
+async def main_async(args) -> dict:
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    endpoints = [e.strip().lstrip("/") for e in args.endpoints.split(",") if e.strip()]
+    stream = None if args.stream == "default" else args.stream == "on"
+    limits = httpx.Limits(max_connections=max(levels) + 2)
+    timeout = httpx.Timeout(args.timeout)
+    result = {"config": vars(args), "levels": []}
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout) as http:
+        for _ in range(args.warmup):
+            for endpoint in endpoints:
+                await one_request(http, endpoint, args.question[0], "load-warmup", stream)
+        for endpoint in endpoints:
+            for c in levels:
+                level = await run_level(http, endpoint, c, args.requests, args.question,
+                                        not args.repeat, stream)
+                try:
+                    level["server_latency"] = (await http.get("/health")).json().get("latency")
+                except (httpx.HTTPError, ValueError):
+                    level["server_latency"] = None
+                print(describe(level), file=sys.stderr, flush=True)
+                result["levels"].append(level)
+    return result
+
+def main():
+    ap = argparse.ArgumentParser(description="Pruebas de carga de /ask y /speak")
+    ap.add_argument("--url", default="http://127.0.0.1:8088")
+    ap.add_argument("--endpoints", default="ask,speak", help="lista separada por comas")
+    ap.add_argument("--concurrency", default="1,4,16", help="niveles, separados por comas")
+    ap.add_argument("--requests", type=int, default=40, help="peticiones por nivel y endpoint")
+    ap.add_argument("--question", action="append", help="puede repetirse; se reparten en rueda")
+    ap.add_argument("--repeat", action="store_true",
+                    help="repite las preguntas tal cual (mide con la caché de TTS caliente)")
+    ap.add_argument("--stream", choices=("default", "on", "off"), default="default",
+                    help="modo de /speak (default: el del servidor)")
+    ap.add_argument("--warmup", type=int, default=1, help="peticiones de calentamiento por endpoint")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--out", help="guarda el JSON con todos los niveles")
+    args = ap.parse_args()
+    args.question = args.question or ["¿Qué me recomiendas cenar hoy?", "Cuéntame un chiste corto", "¿Qué tiempo hará mañana?"]
+
+    result = asyncio.run(main_async(args))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+    else:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Replay offline del pipeline de hotword.py con WAV etiquetados.
+
+Los WAV pasan por las mismas etapas que en el contenedor (anillo de captura,
+Porcupine, endpointing, Whisper, envío) pero leídos de disco en vez de parec,
+y el envío va a un assistant de mentira local. El manifiesto es JSONL, una
+línea por WAV (16 kHz, s16le; si es estéreo se mezcla a mono)::
+
+    {"wav": "cmds/luz.wav", "text": "enciende la luz del salón", "wake_end": 0.74}
+
+``wake_end`` (segundos dentro del WAV) es donde acaba la wakeword y
+``speech_end`` donde acaba el comando; si no viene se calcula por energía.
+Los WAV se concatenan con ``--gap`` s de silencio y se sirven a ``--speed``×
+tiempo real; si la detección no da abasto se descartan tramas como con parec
+(``queues.tramas.dropped``). Sale un JSON con métricas por comando y su resumen:
+
+    python bench/replay.py cmds.jsonl --speed 2 --out base.json
+    WHISPER_BEAM=1 python bench/replay.py cmds.jsonl --out greedy.json --baseline base.json
+
+La configuración de hotword (WHISPER_*, ENDPOINTER, SILENCE_*…) se toma del
+entorno igual que en el servicio.
+"""
+
+import argparse, bisect, json, os, re, resource, sys, threading, time, wave
+from contextlib import redirect_stdout
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+TONTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RATE = 16000
+CONFIG_PREFIXES = ("WHISPER_", "ENDPOINTER", "VAD_", "WEBRTC_", "SILENCE_", "SPEECH_",
+                   "WAKE", "MIN_TALK", "MAX_CMD", "PIPE_")
+
+class Item:
+    """Un WAV del manifiesto; ``offset`` es su primera muestra en el replay."""
+
+    def __init__(self, wav: str, text: str, pcm: np.ndarray,
+                 wake_end: float | None, speech_end: float | None):
+        self.wav = wav
+        self.text = text
+        self.pcm = pcm
+        self.wake_end = wake_end
+        self.speech_end = speech_end if speech_end is not None else _speech_end(pcm)
+        self.offset = 0
+
+def _speech_end(pcm: np.ndarray, frame: int = 512) -> float:
+    """Fin de la última trama a menos de 20 dB de la más fuerte."""
+    from audio_dsp import frame_rms
+    rms = frame_rms(pcm, frame)
+    if rms.size == 0:
+        return 0.0
+    loud = np.flatnonzero(rms >= 0.1 * rms.max())
+    return (int(loud[-1]) + 1) * frame / RATE
+
+def read_wav(path: str) -> np.ndarray:
+    with wave.open(path, "rb") as wf:
+        if wf.getsampwidth() != 2 or wf.getframerate() != RATE:
+            raise ValueError(f"{path}: hace falta s16le a {RATE} Hz "
+                             f"(tiene {wf.getsampwidth() * 8} bits a {wf.getframerate()} Hz)")
+        pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype="<i2")
+        ch = wf.getnchannels()
+    if ch > 1:
+        pcm = pcm[:pcm.size // ch * ch].reshape(-1, ch).mean(axis=1)
+    return pcm.astype(np.int16)
+
+def load_manifest(path: str) -> list[Item]:
+    base = os.path.dirname(os.path.abspath(path))
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            d = json.loads(line)
+            if "wav" not in d or "text" not in d:
+                raise ValueError(f"{path}:{n}: faltan 'wav' o 'text'")
+            wav = os.path.join(base, d["wav"])
+            items.append(Item(d["wav"], d["text"], read_wav(wav), d.get("wake_end"), d.get("speech_end")))
+    return items
+
+def concat(items: list[Item], gap: float) -> np.ndarray:
+    """Silencio, WAV, silencio, WAV… silencio; fija ``offset`` de cada uno."""
+    silence = np.zeros(int(gap * RATE), dtype=np.int16)
+    parts, pos = [silence], silence.size
+    for it in items:
+        it.offset = pos
+        parts += [it.pcm, silence]
+        pos += it.pcm.size + silence.size
+    return np.concatenate(parts)
+
+class WavStream:
+    """``readinto`` como el stdout de parec, al ritmo de ``speed``× tiempo real.
+    Apunta cuándo quedó disponible cada tramo para medir latencias en reloj real."""
+
+    def __init__(self, pcm: np.ndarray, speed: float):
+        self.raw = memoryview(np.ascontiguousarray(pcm, dtype="<i2")).cast("B")
+        self.speed = speed
+        self.pos = 0
+        self.t0 = None
+        self.marks_pos: list[int] = []     # muestras servidas…
+        self.marks_t: list[float] = []     # …y cuándo
+
+    def readinto(self, b) -> int:
+        if self.t0 is None:
+            self.t0 = time.monotonic()
+        n = min(len(b), len(self.raw) - self.pos) & ~1
+        if n <= 0:
+            return 0
+        b[:n] = self.raw[self.pos:self.pos + n]
+        self.pos += n
+        wait = self.t0 + self.pos / 2 / RATE / self.speed - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self.marks_pos.append(self.pos // 2)
+        self.marks_t.append(time.monotonic())
+        return n
+
+    def t_at(self, sample: int) -> float | None:
+        """Cuándo se entregó la muestra ``sample`` (absoluta)."""
+        i = bisect.bisect_left(self.marks_pos, sample)
+        return self.marks_t[i] if i < len(self.marks_t) else None
+
+class StubAssistant:
+    """/speak y /barge-in que responden 200 al momento y apuntan lo recibido."""
+
+    def __init__(self):
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                size = int(self.headers.get("content-length") or 0)
+                body = self.rfile.read(size) if size else b""
+                try:
+                    data = json.loads(body or b"{}")
+                except ValueError:
+                    data = {}
+                stub.requests.append({"path": self.path, "body": data, "t": time.monotonic()})
+                out = json.dumps({"ok": True}).encode()
+                self.send_response(200)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def log_message(self, *a):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, name="stub-assistant", daemon=True).start()
+
+    def count(self, path: str) -> int:
+        return sum(1 for r in self.requests if r["path"] == path)
+
+class ThreadCpu:
+    """CPU por etapa (hilos ``hotword-<etapa>-…``) leyendo /proc/self/task cada
+    ``interval`` s. Aproximado: lo que gasta un hilo en su último intervalo
+    antes de terminar no se ve. Fuera de Linux solo queda el total."""
+
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        self.tick = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self.cpu: dict[str, float] = {}
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="stub-cpu", daemon=True)
+
+    def _run(self):
+        while not self.stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        for th in threading.enumerate():
+            if not th.name.startswith("hotword-") or not th.native_id:
+                continue
+            try:
+                with open(f"/proc/self/task/{th.native_id}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except (OSError, IndexError):
+                continue
+            # utime y stime son los campos 14 y 15 de stat (11 y 12 tras "pid (comm)")
+            self.cpu[th.name] = (int(fields[11]) + int(fields[12])) / self.tick
+
+    def by_stage(self) -> dict:
+        out: dict[str, float] = {}
+        for name, secs in self.cpu.items():
+            stage = name.split("-")[1]
+            out[stage] = round(out.get(stage, 0.0) + secs, 3)
+        return out
+
+def words(text: str) -> list[str]:
+    return re.sub(r"[^\w\s]", " ", (text or "").lower()).split()
+
+def edit_distance(ref: list, hyp: list) -> int:
+    row = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        prev, row[0] = row[0], i
+        for j, h in enumerate(hyp, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (r != h))
+    return row[-1]
+
+def pct(values: list) -> dict | None:
+    v = [x for x in values if x is not None]
+    if not v:
+        return None
+    return {"p50": round(float(np.percentile(v, 50)), 3), "p95": round(float(np.percentile(v, 95)), 3),
+            "max": round(float(max(v)), 3), "n": len(v)}
+
+def ms(a: float | None, b: float | None) -> int | None:
+    return round((b - a) * 1000) if a is not None and b is not None else None
+
+def measure(items: list[Item], utts: list, stream: WavStream) -> tuple[list, int]:
+    """Empareja cada comando con su WAV (por cuándo se detectó la wakeword) y
+    calcula sus métricas. Devuelve las filas y las wakewords sobrantes."""
+    starts = [stream.t_at(it.offset) or float("inf") for it in items]
+    by_item: dict[int, list] = {}
+    stray = 0
+    for utt in sorted(utts, key=lambda u: u.t_detect or u.t_wake):
+        i = bisect.bisect_right(starts, utt.t_detect or utt.t_wake) - 1
+        if i < 0:
+            stray += 1
+        else:
+            by_item.setdefault(i, []).append(utt)
+
+    rows = []
+    for i, it in enumerate(items):
+        found = by_item.get(i, [])
+        stray += max(0, len(found) - 1)
+        utt = found[0] if found else None
+        ref = words(it.text)
+        hyp = words(utt.text) if utt else []
+        edits = edit_distance(ref, hyp)
+        row = {"wav": it.wav, "ref": it.text, "hyp": utt.text if utt else None,
+               "detected": utt is not None, "ref_words": len(ref), "edits": edits,
+               "wer": round(edits / max(1, len(ref)), 3)}
+        if utt is not None:
+            t_speech_end = stream.t_at(it.offset + int(it.speech_end * RATE))
+            t = utt.timings()
+            decode_ms = (utt.decode or {}).get("ms", t["eos_to_text_ms"])
+            row.update({
+                "source": utt.source,
+                "wake_ms": ms(stream.t_at(it.offset + int(it.wake_end * RATE)), utt.t_detect)
+                           if it.wake_end is not None else None,
+                "eos_ms": ms(t_speech_end, utt.t_eos),
+                "audio_s": t["audio_s"],
+                "decode_ms": decode_ms,
+                "rtf": round(decode_ms / 1000 / t["audio_s"], 3) if decode_ms is not None and t["audio_s"] else None,
+                "eos_to_text_ms": t["eos_to_text_ms"],
+                "e2e_ms": ms(t_speech_end, utt.t_sent),
+                "decode": utt.decode,
+            })
+        rows.append(row)
+    return rows, stray
+
+def summarize(rows: list, stray: int) -> dict:
+    ref_words = sum(r["ref_words"] for r in rows)
+    detected = [r for r in rows if r["detected"]]
+    return {
+        "items": len(rows),
+        "detected": len(detected),
+        "missed": len(rows) - len(detected),
+        "false_wakes": stray,
+        "wer": round(sum(r["edits"] for r in rows) / max(1, ref_words), 4),
+        **{k: pct([r.get(k) for r in detected])
+           for k in ("wake_ms", "eos_ms", "rtf", "eos_to_text_ms", "e2e_ms")},
+    }
+
+def compare(now: dict, base: dict) -> list[str]:
+    """Líneas ``métrica: antes → ahora`` para las cifras del resumen."""
+    out = []
+    a, b = base.get("summary", {}), now.get("summary", {})
+    for key in ("wer", "missed", "false_wakes"):
+        out.append(f"{key:15} {a.get(key)} → {b.get(key)}")
+    for key in ("wake_ms", "eos_ms", "rtf", "eos_to_text_ms", "e2e_ms"):
+        for p in ("p50", "p95"):
+            x, y = (a.get(key) or {}).get(p), (b.get(key) or {}).get(p)
+            delta = f"  ({(y - x) / x * 100:+.0f}%)" if x and y is not None else ""
+            out.append(f"{key + '.' + p:15} {x} → {y}{delta}")
+    x, y = base.get("cpu", {}).get("percent"), now.get("cpu", {}).get("percent")
+    out.append(f"{'cpu %':15} {x} → {y}")
+    return out
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("manifest", help="JSONL con wav, text y opcionalmente wake_end / speech_end")
+    ap.add_argument("--speed", type=float, default=1.0, help="×tiempo real")
+    ap.add_argument("--gap", type=float, default=2.0, help="silencio entre WAV (s)")
+    ap.add_argument("--out", help="escribe el JSON aquí en vez de en stdout")
+    ap.add_argument("--baseline", help="JSON de una ejecución anterior para comparar (a stderr)")
+    args = ap.parse_args()
+    if args.speed <= 0:
+        ap.error("--speed tiene que ser > 0")
+
+    sys.path.insert(0, TONTO)
+    items = load_manifest(args.manifest)
+    pcm = concat(items, args.gap)
+
+    stub = StubAssistant()
+    # hotword lee su configuración al importarse
+    os.environ["ASSISTANT_URL"] = stub.url + "/speak"
+    os.environ["BARGE_IN_URL"] = stub.url + "/barge-in"
+    os.environ["WAKE_BEEP"] = "0"
+    os.environ.setdefault("HOTWORD_SESSION", "replay")
+
+    stream = WavStream(pcm, args.speed)
+    cpu = ThreadCpu()
+    with redirect_stdout(sys.stderr):      # los logs de hotword no ensucian el JSON
+        import hotword
+        hotword.log_env()
+        cpu.thread.start()
+        r0, w0 = resource.getrusage(resource.RUSAGE_SELF), time.monotonic()
+        utts, queues = hotword.run_pipe_porcupine(streams={"replay": stream}, preload=True)
+        r1, wall = resource.getrusage(resource.RUSAGE_SELF), time.monotonic() - w0
+        cpu.stop.set()
+        cpu.thread.join()
+
+    rows, stray = measure(items, utts, stream)
+    cpu_s = (r1.ru_utime - r0.ru_utime) + (r1.ru_stime - r0.ru_stime)
+    result = {
+        "config": {"speed": args.speed, "gap": args.gap, "manifest": args.manifest,
+                   "model": hotword.MODEL_SIZE, "device": hotword.DEVICE,
+                   "env": {k: v for k, v in sorted(os.environ.items()) if k.startswith(CONFIG_PREFIXES)}},
+        "summary": summarize(rows, stray),
+        "audio_s": round(pcm.size / RATE, 2),
+        "wall_s": round(wall, 2),
+        "cpu": {"total_s": round(cpu_s, 2), "percent": round(cpu_s / wall * 100, 1) if wall else None,
+                "stages": cpu.by_stage()},
+        "startup_ms": dict(hotword.STARTUP.phases),
+        "queues": {q.name: q.stats() for q in queues},
+        "assistant": {"speak": stub.count("/speak"), "barge_in": stub.count("/barge-in")},
+        "items": rows,
+    }
+    stub.server.shutdown()
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            base = json.load(f)
+        print("\n".join(compare(result, base)), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Servidor local que imita los endpoints de Vertex AI que usa tonto.
+
+Sirve ``:generateContent``, ``:streamGenerateContent?alt=sse``,
+``:countTokens`` y ``cachedContents`` sin salir a la red ni gastar cuota. Valida la forma de
+cada petición igual que Vertex (roles user/model alternos empezando y
+acabando en user, ``systemInstruction`` y ``cachedContent`` excluyentes,
+caché existente…) y devuelve ``usageMetadata`` con la contabilidad de
+tokens; ``GET /_stats`` resume lo que ha visto. ``--latency``/``--jitter``
+(hasta el primer token) y ``--tokens-per-sec`` (ritmo de la respuesta) imitan
+los tiempos del modelo para las pruebas de carga (bench/loadgen.py).
+
+    python bench/vertex_stub.py --port 8099
+    GCP_PROJECT_ID=stub VERTEX_BASE_URL=http://127.0.0.1:8099 VERTEX_STATIC_TOKEN=stub \\
+        uvicorn app:app --port 8088
+"""
+
+import argparse, json, random, re, threading, time, uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+def count_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def _parts_text(parts) -> str | None:
+    if not isinstance(parts, list) or not parts:
+        return None
+    if not all(isinstance(p, dict) and isinstance(p.get("text"), str) for p in parts):
+        return None
+    return "".join(p["text"] for p in parts)
+
+class StubState:
+    def __init__(self, reply: str, min_cache_tokens: int, latency: float = 0.0,
+                 jitter: float = 0.0, tokens_per_sec: float = 0.0):
+        self.reply = reply
+        self.min_cache_tokens = min_cache_tokens
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_sec = tokens_per_sec
+        self.caches: dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.stats = {
+            "requests": 0, "rejected": 0, "errors": [],
+            "cache_created": 0, "cache_hits": 0, "inline_system": 0,
+            "promptTokenCount": 0, "cachedContentTokenCount": 0, "candidatesTokenCount": 0,
+        }
+
+    def first_token_delay(self) -> float:
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def token_delay(self, text: str) -> float:
+        return count_tokens(text) / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+
+    def reject(self, msg: str) -> tuple[int, dict]:
+        with self.lock:
+            self.stats["rejected"] += 1
+            self.stats["errors"] = (self.stats["errors"] + [msg])[-20:]
+        return 400, {"error": {"code": 400, "message": msg, "status": "INVALID_ARGUMENT"}}
+
+    def create_cache(self, path: str, body: dict) -> tuple[int, dict]:
+        system = _parts_text((body.get("systemInstruction") or {}).get("parts"))
+        if system is None:
+            return self.reject("cachedContents: falta systemInstruction.parts[].text")
+        if not str(body.get("model", "")).startswith("projects/"):
+            return self.reject(f"cachedContents: model inválido: {body.get('model')!r}")
+        tokens = count_tokens(system)
+        if tokens < self.min_cache_tokens:
+            return self.reject(f"cachedContents: {tokens} tokens < mínimo {self.min_cache_tokens}")
+        ttl = float(str(body.get("ttl", "3600s")).rstrip("s"))
+        name = f"{path.strip('/').split('/', 1)[1]}/{uuid.uuid4().hex[:16]}"
+        with self.lock:
+            self.caches[name] = {"tokens": tokens, "expires": time.time() + ttl}
+            self.stats["cache_created"] += 1
+        expire = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + ttl))
+        return 200, {"name": name, "model": body["model"], "expireTime": expire,
+                     "usageMetadata": {"totalTokenCount": tokens}}
+
+    def check_generate(self, body: dict) -> tuple[str | None, dict | str]:
+        """Devuelve (respuesta, usage) o (None, motivo del rechazo)."""
+        contents = body.get("contents")
+        if not isinstance(contents, list) or not contents:
+            return None, "contents vacío"
+        prompt_tokens = 0
+        prev = None
+        for i, c in enumerate(contents):
+            role = c.get("role")
+            if role not in ("user", "model"):
+                return None, f"contents[{i}].role inválido: {role!r}"
+            if role == prev:
+                return None, f"contents[{i}]: dos turnos seguidos con role={role}"
+            text = _parts_text(c.get("parts"))
+            if text is None:
+                return None, f"contents[{i}].parts sin texto"
+            if re.search(r"\[/?(user|assistant|system)\]", text):
+                return None, f"contents[{i}]: marcas [user]/[assistant] en el texto"
+            prompt_tokens += count_tokens(text)
+            prev = role
+        if contents[0]["role"] != "user" or contents[-1]["role"] != "user":
+            return None, "contents debe empezar y acabar con role=user"
+
+        cached_tokens = 0
+        if "cachedContent" in body:
+            if "systemInstruction" in body:
+                return None, "cachedContent y systemInstruction son excluyentes"
+            with self.lock:
+                entry = self.caches.get(body["cachedContent"])
+            if entry is None or entry["expires"] < time.time():
+                return None, f"cachedContent desconocido o caducado: {body['cachedContent']}"
+            cached_tokens = entry["tokens"]
+        elif "systemInstruction" in body:
+            system = _parts_text(body["systemInstruction"].get("parts"))
+            if system is None:
+                return None, "systemInstruction.parts sin texto"
+            prompt_tokens += count_tokens(system)
+
+        question = _parts_text(contents[-1]["parts"])
+        answer = self.reply.format(question=question)
+        usage = {
+            "promptTokenCount": prompt_tokens + cached_tokens,
+            "candidatesTokenCount": count_tokens(answer),
+        }
+        if cached_tokens:
+            usage["cachedContentTokenCount"] = cached_tokens
+        usage["totalTokenCount"] = usage["promptTokenCount"] + usage["candidatesTokenCount"]
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["cache_hits"] += bool(cached_tokens)
+            self.stats["inline_system"] += "systemInstruction" in body
+            for k in ("promptTokenCount", "cachedContentTokenCount", "candidatesTokenCount"):
+                self.stats[k] += usage.get(k, 0)
+        return answer, usage
+
+def _candidate(text: str) -> dict:
+    return {"content": {"role": "model", "parts": [{"text": text}]}}
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, code: int, data: dict) -> None:
+            raw = json.dumps(data).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def _chunk(self, raw: bytes) -> None:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(raw), raw))
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path == "/_stats":
+                with state.lock:
+                    return self._json(200, dict(state.stats, caches=len(state.caches)))
+            self._json(404, {"error": {"code": 404, "message": self.path}})
+
+        def do_POST(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = json.loads(self.rfile.read(n) or b"{}")
+            except ValueError:
+                return self._json(*state.reject("JSON inválido"))
+            if not (self.headers.get("Authorization") or "").startswith("Bearer "):
+                return self._json(401, {"error": {"code": 401, "message": "falta Authorization"}})
+
+            path = self.path.split("?", 1)[0]
+            if path.endswith("/cachedContents"):
+                return self._json(*state.create_cache(path, body))
+            if path.endswith(":countTokens"):
+                text = "".join(_parts_text(c.get("parts")) or "" for c in body.get("contents") or [])
+                return self._json(200, {"totalTokens": count_tokens(text), "totalBillableCharacters": len(text)})
+            if not (path.endswith(":generateContent") or path.endswith(":streamGenerateContent")):
+                return self._json(404, {"error": {"code": 404, "message": path}})
+
+            answer, usage = state.check_generate(body)
+            if answer is None:
+                return self._json(*state.reject(usage))
+            time.sleep(state.first_token_delay())
+            if path.endswith(":generateContent"):
+                time.sleep(state.token_delay(answer))
+                return self._json(200, {"candidates": [_candidate(answer)], "usageMetadata": usage})
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            words = answer.split(" ")
+            for i, w in enumerate(words):
+                if i:
+                    time.sleep(state.token_delay(w))
+                event = {"candidates": [_candidate(w if i == 0 else " " + w)]}
+                if i == len(words) - 1:
+                    event["usageMetadata"] = usage
+                self._chunk(f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8"))
+            self._chunk(b"")
+
+    return Handler
+
+def serve(host: str, port: int, state: StubState) -> ThreadingHTTPServer:
+    srv = ThreadingHTTPServer((host, port), make_handler(state))
+    srv.daemon_threads = True
+    return srv
+
+def main():
+    ap = argparse.ArgumentParser(description="Vertex AI local para tonto")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8099)
+    ap.add_argument("--reply", default="Vale. Me has dicho: {question}. Eso es todo lo que sé.")
+    ap.add_argument("--min-cache-tokens", type=int, default=0,
+                    help="rechaza cachedContents más pequeños (Vertex exige un mínimo)")
+    ap.add_argument("--latency", type=float, default=0.0, help="segundos hasta el primer token")
+    ap.add_argument("--jitter", type=float, default=0.0, help="± segundos aleatorios sobre --latency")
+    ap.add_argument("--tokens-per-sec", type=float, default=0.0,
+                    help="ritmo de generación de la respuesta (0 = de golpe)")
+    args = ap.parse_args()
+    srv = serve(args.host, args.port, StubState(args.reply, args.min_cache_tokens,
+                                                args.latency, args.jitter, args.tokens_per_sec))
+    print(f"[vertex-stub] escuchando en http://{args.host}:{args.port}", flush=True)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
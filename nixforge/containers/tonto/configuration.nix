@@ -14,7 +14,8 @@ let
   };
 
   pythonEnv = pkgs.python3.withPackages (ps: [
-    ps.fastapi ps.uvicorn ps.pydantic ps.requests ps.google-auth ps.grpcio ps.protobuf
+    ps.fastapi ps.uvicorn ps.pydantic ps.requests ps.httpx ps.google-auth ps.grpcio ps.protobuf
+    ps.prometheus-client
   ]);
 in
 {
@@ -59,8 +60,10 @@ in
       set -euo pipefail
       if [ ! -x "${venvPath}/bin/python" ]; then
         ${pythonEnv}/bin/python -m venv "${venvPath}"
-        ln -sf ${pythonEnv}/bin/* "${venvPath}/bin/" || true
       fi
+      # En cada arranque: si pythonEnv cambia (dependencias nuevas) los enlaces
+      # de un venv ya existente seguirían apuntando al store anterior
+      ln -sf ${pythonEnv}/bin/* "${venvPath}/bin/"
       echo "[tonto-venv] OK (sin pip)"
     '';
   };
@@ -82,10 +85,23 @@ in
         "GCP_LOCATION=europe-southwest1"
         "GEMINI_MODEL=gemini-2.0-flash"
         "PYTHONUNBUFFERED=1"
+        "VERTEX_POOL_SIZE=4"
+        "VERTEX_CONNECT_TIMEOUT=5"
+        "VERTEX_READ_TIMEOUT=60"
+        "TONTO_LLM_CONCURRENCY=4"
+        "TONTO_TTS_CONCURRENCY=1"
+        "TONTO_SPEAK_QUEUE=8"
+        "TONTO_SPEAK_WORKERS=2"
+        "TONTO_HISTORY_TOKENS=800"
+        "TONTO_HISTORY_DB=/var/lib/tonto/history.sqlite"
 
         "PIPER_MODEL=/etc/piper/models/es_ES-carlfm-x_low.onnx"
         "PIPER_BIN=/run/current-system/sw/bin/piper"
         "PREFER_PIPER=true"
+        "TONTO_STREAM=true"
+        "TONTO_FILLER_AFTER_MS=1500"
+        "TONTO_TTS_CACHE_DIR=/var/lib/tonto/tts-cache"
+        "TONTO_TTS_CACHE_BYTES=67108864"
 
         "PULSE_SERVER=tcp:192.168.105.1:4713"
       ];
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Earcons de hotword.py: pitidos renderizados una vez en memoria y un único
+``pacat`` abierto al que se escriben, sin lanzar un proceso por pitido.
+
+``play()`` no bloquea: deja el nombre en una cola corta y un hilo lo escribe.
+Si ``pacat`` no está o se cae, se reabre en el siguiente pitido; sin ``pacat``
+se vuelve al ``aplay`` de un WAV, como antes.
+"""
+
+import os, queue, shutil, subprocess, tempfile, threading, wave
+
+import numpy as np
+from audio_dsp import beep_pcm
+
+RATE = 16000
+# Latencia corta para que el pitido no espere a llenar el búfer de Pulse; el
+# silencio de cola asegura que siempre se supera el prebuf tras un underrun
+LATENCY_MSEC = 60
+TAIL_SEC = 0.15
+
+def _tones(*parts, rate=RATE) -> bytes:
+    """``(hz, seg)`` encadenados (hz=0 es silencio) más la cola, en s16le."""
+    chunks = [beep_pcm(hz, dur, rate) if hz else np.zeros(int(rate * dur), np.int16) for hz, dur in parts]
+    chunks.append(np.zeros(int(rate * TAIL_SEC), np.int16))
+    return np.concatenate(chunks).astype("<i2").tobytes()
+
+CUES = {
+    "wake":  _tones((880, 0.12)),
+    "ready": _tones((660, 0.08), (0, 0.04), (880, 0.08)),
+    "error": _tones((440, 0.12), (0, 0.04), (330, 0.18)),
+}
+
+class CuePlayer:
+    def __init__(self, enabled: bool = True, rate: int = RATE):
+        self.enabled = enabled
+        self.rate = rate
+        self.q: queue.Queue = queue.Queue(maxsize=4)
+        self.proc: subprocess.Popen | None = None
+        self.pacat = shutil.which("pacat")
+        self.played = 0
+        self.failed = 0
+        self._wavs: dict[str, str] = {}
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if not self.enabled or self._thread is not None:
+            return
+        if self.pacat is None:
+            print("[earcons] pacat no está en PATH; se usará aplay", flush=True)
+        self._thread = threading.Thread(target=self._run, name="hotword-earcons", daemon=True)
+        self._thread.start()
+
+    def play(self, name: str) -> None:
+        if not self.enabled:
+            return
+        self.start()
+        try:
+            self.q.put_nowait(name)
+        except queue.Full:
+            pass  # ya hay pitidos pendientes: uno más no aporta nada
+
+    def close(self) -> None:
+        if self.proc is not None:
+            try:
+                self.proc.stdin.close()
+            except Exception:
+                pass
+            self.proc.kill()
+            self.proc = None
+
+    def _open(self) -> subprocess.Popen:
+        if self.proc is None or self.proc.poll() is not None:
+            self.proc = subprocess.Popen(
+                [self.pacat, "--playback", "--raw", "--format=s16le", f"--rate={self.rate}",
+                 "--channels=1", f"--latency-msec={LATENCY_MSEC}", "--client-name=hotword",
+                 "--stream-name=earcons"],
+                stdin=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+        return self.proc
+
+    def _aplay(self, name: str) -> None:
+        path = self._wavs.get(name)
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix=f"hotword-{name}-", suffix=".wav")
+            with os.fdopen(fd, "wb") as f, wave.open(f, "wb") as wf:
+                wf.setnchannels(1); wf.setsampwidth(2); wf.setframerate(self.rate)
+                wf.writeframes(CUES[name])
+            self._wavs[name] = path
+        subprocess.Popen(["aplay", "-q", path])
+
+    def _run(self) -> None:
+        while True:
+            name = self.q.get()
+            try:
+                if self.pacat is None:
+                    self._aplay(name)
+                else:
+                    try:
+                        self._open().stdin.write(CUES[name])
+                    except (BrokenPipeError, OSError):
+                        self.close()   # pacat se cayó (p.ej. Pulse reiniciado): otra vez, ya
+                        self._open().stdin.write(CUES[name])
+                self.played += 1
+            except Exception as e:
+                self.failed += 1
+                self.close()
+                print(f"[earcons] error con '{name}': {e}", flush=True)
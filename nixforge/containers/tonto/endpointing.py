@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Detección de fin de habla para el modo pipe de hotword.py.
+
+Dos piezas: un clasificador voz/no-voz por trama (``Endpointer``:
+umbral fijo, suelo de ruido adaptativo o webrtcvad) y ``EndpointTracker``,
+que decide cuándo cortar. El tiempo de espera tras la última voz (hang) no
+es fijo: se ajusta a las pausas que hace el propio usuario dentro de la
+frase y se recuerda entre comandos.
+"""
+
+import math
+from abc import ABC, abstractmethod
+from collections import deque
+
+import numpy as np
+
+class Endpointer(ABC):
+    """Clasificador por trama. ``observe`` recibe las tramas sin grabación
+    (esperando wakeword) para aprender el ruido de fondo."""
+
+    name = "base"
+
+    def __init__(self, rate: int, frame: int):
+        self.rate = rate
+        self.frame = frame
+
+    def observe(self, frame: np.ndarray, rms: float) -> None:
+        pass
+
+    @abstractmethod
+    def is_speech(self, frame: np.ndarray, rms: float) -> bool:
+        ...
+
+    @abstractmethod
+    def quiet_rms(self) -> float:
+        """Nivel por debajo del cual una trama cuenta como silencio (para recortes)."""
+
+    def describe(self) -> str:
+        return self.name
+
+class EnergyEndpointer(Endpointer):
+    """Umbral RMS fijo (el comportamiento clásico, ``SILENCE_RMS``)."""
+
+    name = "energy"
+
+    def __init__(self, rate: int, frame: int, threshold: float):
+        super().__init__(rate, frame)
+        self.threshold = threshold
+
+    def is_speech(self, frame, rms):
+        return rms >= self.threshold
+
+    def quiet_rms(self):
+        return self.threshold
+
+    def describe(self):
+        return f"energy(rms≥{self.threshold:.0f})"
+
+class NoiseFloorEndpointer(Endpointer):
+    """Voz = RMS por encima del suelo de ruido más ``margin_db``, con histéresis.
+
+    El suelo baja deprisa y sube despacio (seguidor asimétrico), y solo se
+    alimenta de tramas que no son voz, así un comando largo no lo arrastra."""
+
+    name = "adaptive"
+
+    def __init__(self, rate: int, frame: int, margin_db: float = 10.0, min_rms: float = 150.0,
+                 release_db: float = 4.0, initial_floor: float = 300.0):
+        super().__init__(rate, frame)
+        self.margin = 10 ** (margin_db / 20.0)
+        self.release = 10 ** (max(0.0, margin_db - release_db) / 20.0)
+        self.min_rms = min_rms
+        self.floor = initial_floor
+        fps = rate / float(frame)
+        self._down = 1.0 - math.exp(-1.0 / (0.2 * fps))     # ~0.2 s para bajar
+        self._up = 1.0 - math.exp(-1.0 / (3.0 * fps))       # ~3 s para subir
+        self._speaking = False
+
+    def _track(self, rms: float) -> None:
+        k = self._down if rms < self.floor else self._up
+        self.floor = max(1.0, self.floor + k * (rms - self.floor))
+
+    def observe(self, frame, rms):
+        self._speaking = False
+        self._track(rms)
+
+    def is_speech(self, frame, rms):
+        level = self.floor * (self.release if self._speaking else self.margin)
+        self._speaking = rms >= max(self.min_rms, level)
+        if not self._speaking:
+            self._track(rms)
+        return self._speaking
+
+    def quiet_rms(self):
+        return max(self.min_rms, self.floor * self.margin)
+
+    def describe(self):
+        return f"adaptive(suelo={self.floor:.0f} umbral={self.quiet_rms():.0f})"
+
+class WebRtcEndpointer(NoiseFloorEndpointer):
+    """webrtcvad sobre subtramas de 10 ms (voto mayoritario), con el suelo de
+    ruido como puerta: lo que no supera ``min_rms`` no se considera voz."""
+
+    name = "webrtc"
+
+    def __init__(self, rate: int, frame: int, mode: int = 2, **kw):
+        import webrtcvad
+        super().__init__(rate, frame, **kw)
+        self.vad = webrtcvad.Vad(mode)
+        self.sub = rate // 100
+        self.mode = mode
+
+    def is_speech(self, frame, rms):
+        n = len(frame) // self.sub
+        raw = np.ascontiguousarray(frame[:n * self.sub]).tobytes()
+        step = self.sub * 2
+        votes = sum(self.vad.is_speech(raw[i * step:(i + 1) * step], self.rate) for i in range(n))
+        speech = votes * 2 > n and rms >= self.min_rms
+        self._speaking = speech
+        if not speech:
+            self._track(rms)
+        return speech
+
+    def describe(self):
+        return f"webrtc(mode={self.mode} suelo={self.floor:.0f})"
+
+def make_endpointer(kind: str, rate: int, frame: int, *, silence_rms: float,
+                    margin_db: float, webrtc_mode: int) -> Endpointer:
+    kind = (kind or "adaptive").lower()
+    if kind == "energy":
+        return EnergyEndpointer(rate, frame, silence_rms)
+    if kind == "webrtc":
+        try:
+            return WebRtcEndpointer(rate, frame, webrtc_mode, margin_db=margin_db)
+        except ImportError as e:
+            print(f"[endpoint] webrtcvad no disponible ({e}); uso adaptive", flush=True)
+    elif kind != "adaptive":
+        print(f"[endpoint] ENDPOINTER desconocido: {kind!r}; uso adaptive", flush=True)
+    return NoiseFloorEndpointer(rate, frame, margin_db=margin_db)
+
+class EndpointTracker:
+    """Decide el fin de un comando trama a trama.
+
+    - No corta antes de ``min_talk`` segundos.
+    - Si en ``start_timeout`` segundos no ha habido voz, corta (``sin voz``).
+    - Tras la voz, corta después de ``hang`` segundos de silencio; ``hang``
+      parte de 1.5× el percentil 90 de las pausas dentro de frase de los
+      comandos recientes, crece si este comando trae pausas más largas y
+      queda acotado a ``[hang_min, hang_max]``.
+    """
+
+    def __init__(self, vad: Endpointer, *, min_talk: float, max_cmd: float,
+                 hang_min: float, hang_max: float, start_timeout: float):
+        self.vad = vad
+        fps = vad.rate / float(vad.frame)
+        self.fps = fps
+        self.min_frames = int(fps * min_talk)
+        self.max_frames = int(fps * max_cmd)
+        self.hang_min = max(1, int(fps * hang_min))
+        self.hang_max = max(self.hang_min, int(fps * hang_max))
+        self.start_frames = int(fps * start_timeout)
+        self.pauses = deque(maxlen=64)      # pausas internas (tramas) de comandos recientes
+        self.begin()
+
+    def _hang_for(self, pause: float) -> int:
+        return min(self.hang_max, max(self.hang_min, int(round(1.5 * pause))))
+
+    def begin(self, preroll=()) -> None:
+        self.frames = 0
+        self.speech_frames = 0
+        self.silent = 0
+        self.heard = False
+        learned = float(np.percentile(self.pauses, 90)) if self.pauses else 0.0
+        self.hang = self._hang_for(learned) if learned else self.hang_max
+        for frame, rms in preroll:
+            self.step(frame, rms)
+        # min_talk/max_cmd cuentan desde la detección, no desde el pre-roll
+        self.frames = 0
+
+    def step(self, frame: np.ndarray, rms: float) -> str | None:
+        self.frames += 1
+        if self.vad.is_speech(frame, rms):
+            if self.heard and self.silent:
+                # Pausa dentro de la frase: el usuario sigue hablando
+                self.pauses.append(self.silent)
+                self.hang = max(self.hang, self._hang_for(self.silent))
+            self.heard = True
+            self.speech_frames += 1
+            self.silent = 0
+        else:
+            self.silent += 1
+
+        if self.frames >= self.max_frames:
+            return "max timeout"
+        if not self.heard:
+            return "sin voz" if self.frames >= self.start_frames else None
+        if self.frames > self.min_frames and self.silent >= self.hang:
+            return "silencio"
+        return None
+
+    def summary(self) -> str:
+        return (f"hang={self.hang / self.fps:.2f}s voz={self.speech_frames / self.fps:.2f}s "
+                f"{self.vad.describe()}")
@@ -15,6 +15,14 @@ in
   ];
 
   environment.etc."hotword/hotword.py".text = builtins.readFile ./hotword.py;
+  environment.etc."hotword/audio_dsp.py".text = builtins.readFile ./audio_dsp.py;
+  environment.etc."hotword/pcm_capture.py".text = builtins.readFile ./pcm_capture.py;
+  environment.etc."hotword/pipeline.py".text = builtins.readFile ./pipeline.py;
+  environment.etc."hotword/streaming_stt.py".text = builtins.readFile ./streaming_stt.py;
+  environment.etc."hotword/endpointing.py".text = builtins.readFile ./endpointing.py;
+  environment.etc."hotword/whisper_policy.py".text = builtins.readFile ./whisper_policy.py;
+  environment.etc."hotword/telemetry.py".text = builtins.readFile ./telemetry.py;
+  environment.etc."hotword/earcons.py".text = builtins.readFile ./earcons.py;
 
   environment.etc."openwakeword/.keep".text = "";
 
@@ -86,6 +94,18 @@ in
         touch "${venvPath}/.realtimestt_ok"
       fi
 
+      # VAD opcional para ENDPOINTER=webrtc (ruedas precompiladas); venvs ya creados también
+      if ! "${venvPath}/bin/python" -c "import webrtcvad" >/dev/null 2>&1; then
+        echo "[hotword-venv] instalando webrtcvad"
+        "${venvPath}/bin/pip" install webrtcvad-wheels || echo "[hotword-venv] aviso: webrtcvad no instalado"
+      fi
+
+      # /metrics (HOTWORD_METRICS_PORT); sin él, hotword funciona igual
+      if ! "${venvPath}/bin/python" -c "import prometheus_client" >/dev/null 2>&1; then
+        echo "[hotword-venv] instalando prometheus-client"
+        "${venvPath}/bin/pip" install prometheus-client || echo "[hotword-venv] aviso: prometheus-client no instalado"
+      fi
+
       echo "[hotword-venv] descargando modelos OpenWakeWord (opcional)…"
       "${venvPath}/bin/python" - <<'PYCODE'
 import os, shutil, pathlib
@@ -129,11 +149,19 @@ PYCODE
     environment = {
       PULSE_SERVER       = "tcp:192.168.105.1:4713";
       PULSE_SOURCE       = "alsa_input.pci-0000_00_1b.0.analog-stereo";
+      # Varios micrófonos con un solo Whisper: PULSE_SOURCES = "salon=alsa_input.a,cocina=alsa_input.b";
       USE_PORCUPINE_PIPE = "1";
       WAKEWORDS          = "jarvis,computer,alexa";
       WAKEWORD_SENS      = "0.8";
       WAKEWORD_GAIN      = "1.0";
       ASSISTANT_URL      = "http://localhost:8088/speak";
+      # Con WHISPER_STREAMING = "1" las parciales van a /ingest y el LLM arranca antes:
+      # ASSISTANT_INGEST_URL = "http://localhost:8088/ingest";
+      HOTWORD_METRICS_PORT = "9101";
+      # /etc/hotword/*.py son enlaces al store: sys.path[0] apuntaría allí, no a appDir
+      PYTHONPATH         = appDir;
+      # /etc es de solo lectura: sin esto cada arranque vuelve a compilar los .py
+      PYTHONPYCACHEPREFIX = "/var/cache/hotword";
       WHISPER_MODEL      = "small";
       WHISPER_DEVICE     = "cuda";
       ALSA_PLUGIN_DIR    = "${pkgs.alsa-plugins}/lib/alsa-lib";
@@ -146,8 +174,9 @@ PYCODE
       Type = "simple";
       WorkingDirectory = appDir;
       ExecStart = "${venvPath}/bin/python ${appDir}/hotword.py";
+      CacheDirectory = "hotword";
       Restart = "on-failure";
-      RestartSec = 3;
+      RestartSec = 1;
     };
   };
 }
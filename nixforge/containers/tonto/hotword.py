@@ -1,76 +1,244 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os, sys, time, wave, math, struct, subprocess
+import os, re, sys, json, time, socket, subprocess, threading
+_T_START = time.monotonic()     # antes de numpy y compañía: el arranque se mide desde aquí
 from array import array
 from collections import deque
-
-from faster_whisper import WhisperModel
-
-import pyaudio
-from RealtimeSTT import AudioToTextRecorder
+from contextlib import contextmanager
+
+import numpy as np
+from audio_dsp import apply_gain, frame_rms, vu, VuMeter
+from pcm_capture import PcmRing
+from pipeline import QueueClosed, StageQueue, Utterance, format_stats
+from streaming_stt import StreamingTranscriber
+from endpointing import EndpointTracker, make_endpointer
+from whisper_policy import DecodePolicy, cpu_budget
+import telemetry
+from earcons import CuePlayer
+# faster_whisper, pvporcupine, pyaudio y RealtimeSTT se importan en el modo que los usa
 
 LANGUAGE        = "es"
 MODEL_SIZE      = os.environ.get("WHISPER_MODEL", "small")
 DEVICE          = os.environ.get("WHISPER_DEVICE", "cuda")
 ASSISTANT_URL   = os.environ.get("ASSISTANT_URL", "http://localhost:8088/speak")
+BARGE_IN_URL    = os.environ.get("BARGE_IN_URL", ASSISTANT_URL.rsplit("/", 1)[0] + "/barge-in")
+# Con WHISPER_STREAMING, parciales a /ingest para que el assistant arranque el LLM antes ("" = solo /speak)
+INGEST_URL      = os.environ.get("ASSISTANT_INGEST_URL", "")
+# /ingest responde al recibir el texto final (no espera a que suene): dispatch no espera más que esto
+INGEST_TIMEOUT  = float(os.environ.get("ASSISTANT_INGEST_TIMEOUT", "5"))
 BACKEND_ENV     = os.environ.get("WAKEWORD_BACKEND", "pvporcupine").lower()
 USE_PAREC_PIPE  = os.environ.get("USE_PAREC_PIPE", "0") in ("1", "true", "yes")
 USE_PORCUPINE_PIPE = os.environ.get("USE_PORCUPINE_PIPE", "0") in ("1", "true", "yes")
 PULSE_SERVER    = os.environ.get("PULSE_SERVER", "tcp:192.168.105.1:4713")
 PULSE_SOURCE    = os.environ.get("PULSE_SOURCE", "")
+SESSION_ID      = os.environ.get("HOTWORD_SESSION", socket.gethostname())
+# Listado de dispositivos PyAudio + 1s de parec de prueba antes de escuchar (modo RealtimeSTT)
+PREFLIGHT       = os.environ.get("HOTWORD_PREFLIGHT", "0").lower() in ("1", "true", "yes")
 
 KEYWORDS        = [kw.strip() for kw in os.environ.get("WAKEWORDS", "jarvis,computer,alexa").split(",") if kw.strip()]
 SENS            = float(os.environ.get("WAKEWORD_SENS", "0.95"))
 GAIN_LINEAR     = float(os.environ.get("WAKEWORD_GAIN", "2.0"))
+WAKE_BEEP       = os.environ.get("WAKE_BEEP", "1").lower() in ("1", "true", "yes")
+# La grabación empieza WAKE_PREROLL_SEC antes de la detección, sacado del anillo de captura
+WAKE_PREROLL_SEC = float(os.environ.get("WAKE_PREROLL_SEC", "1.0"))
+WAKE_TRIM       = os.environ.get("WAKE_TRIM", "1").lower() in ("1", "true", "yes")
+# Del pre-roll solo se conserva lo que hay tras la wakeword: como mucho los últimos
+# WAKE_TRIM_KEEP s antes de la detección (lo que tarda Porcupine en disparar)
+WAKE_TRIM_KEEP  = float(os.environ.get("WAKE_TRIM_KEEP", "0.3"))
+# Transcripción incremental durante la grabación (streaming_stt); 0 = una pasada tras el fin de habla
+WHISPER_STREAMING   = os.environ.get("WHISPER_STREAMING", "0").lower() in ("1", "true", "yes")
+WHISPER_STREAM_STEP = float(os.environ.get("WHISPER_STREAM_STEP", "1.0"))
+# Política de decodificación: greedy y beam solo si la confianza es baja (whisper_policy)
+WHISPER_BEAM        = int(os.environ.get("WHISPER_BEAM", "5"))
+WHISPER_MIN_LOGPROB = float(os.environ.get("WHISPER_MIN_LOGPROB", "-0.7"))
+WHISPER_MAX_NOSPEECH = float(os.environ.get("WHISPER_MAX_NOSPEECH", "0.6"))
+WHISPER_TRIM        = os.environ.get("WHISPER_TRIM", "1").lower() in ("1", "true", "yes")
+WHISPER_CPU_THREADS = int(os.environ.get("WHISPER_CPU_THREADS", "0") or 0) or cpu_budget()[0]
+WHISPER_NUM_WORKERS = int(os.environ.get("WHISPER_NUM_WORKERS", "0") or 0)   # 0 = auto
+# Comandos de varias fuentes que terminan a la vez van a Whisper en una sola llamada
+WHISPER_BATCH       = int(os.environ.get("WHISPER_BATCH", "4"))
+WHISPER_BATCH_WAIT  = float(os.environ.get("WHISPER_BATCH_WAIT_MS", "40")) / 1000.0
+
+# --- modo pipe (parec + Porcupine) ---
+# PULSE_SOURCES="salon=alsa_input.a,cocina=alsa_input.b": una captura por fuente, un único Whisper
+PULSE_SOURCES   = os.environ.get("PULSE_SOURCES", "")
+MIN_TALK_SEC           = float(os.environ.get("MIN_TALK_SEC", "0.6"))
+MAX_CMD_SEC            = float(os.environ.get("MAX_CMD_SEC",  "8"))
+SILENCE_RMS_THRESHOLD  = float(os.environ.get("SILENCE_RMS",  "700"))
+SILENCE_HANG_SEC       = float(os.environ.get("SILENCE_HANG", "0.8"))
+SILENCE_HANG_MIN       = float(os.environ.get("SILENCE_HANG_MIN", "0.3"))
+SPEECH_START_TIMEOUT   = float(os.environ.get("SPEECH_START_TIMEOUT", "3.0"))
+ENDPOINTER      = os.environ.get("ENDPOINTER", "adaptive")
+VAD_MARGIN_DB   = float(os.environ.get("VAD_MARGIN_DB", "10"))
+WEBRTC_VAD_MODE = int(os.environ.get("WEBRTC_VAD_MODE", "2"))
+# Cabe el comando más largo con margen: la grabación se saca del anillo como un único tramo
+# (start() lo amplía lo que haga falta para cubrir además el retraso de la cola de tramas)
+CAPTURE_RING_SEC = float(os.environ.get("CAPTURE_RING_SEC", str(MAX_CMD_SEC + WAKE_PREROLL_SEC + 2.0)))
+# Colas entre etapas (en elementos): tramas ~2s, comandos pendientes de Whisper y de envío
+PIPE_FRAME_QUEUE = int(os.environ.get("PIPE_FRAME_QUEUE", "64"))
+PIPE_UTT_QUEUE   = int(os.environ.get("PIPE_UTT_QUEUE",   "2"))
+PIPE_SEND_QUEUE  = int(os.environ.get("PIPE_SEND_QUEUE",  "4"))
+# Métricas Prometheus en :HOTWORD_METRICS_PORT/metrics (0 = sin servidor)
+METRICS_PORT     = int(os.environ.get("HOTWORD_METRICS_PORT", "0") or 0)
+
+def parse_sources(spec: str, default: str) -> list[tuple[str, str]]:
+    """``"id=fuente,…"`` → ``[(id, fuente)]``; sin ``id=`` se numeran (src0, src1…).
+    Vacío: una sola fuente ``default`` (PULSE_SOURCE, o la por defecto de Pulse)."""
+    out = []
+    for i, item in enumerate(x.strip() for x in spec.split(",")):
+        if item:
+            sid, _, src = item.rpartition("=")
+            out.append((sid.strip() or f"src{i}", src.strip()))
+    return out or [("default", default)]
+
+class StartupClock:
+    """Fases del arranque: ``lap`` mide desde la anterior (secuenciales),
+    ``phase`` lo que va en paralelo (la carga de Whisper). ``report`` las
+    imprime junto con el tiempo desde que arrancó el proceso."""
+
+    def __init__(self, t0: float):
+        self.t0 = self.last = t0
+        self.phases = []
+
+    def lap(self, name: str) -> None:
+        now = time.monotonic()
+        self.phases.append((name, round((now - self.last) * 1000)))
+        self.last = now
+
+    @contextmanager
+    def phase(self, name: str):
+        t = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases.append((name, round((time.monotonic() - t) * 1000)))
+            self.last = max(self.last, time.monotonic())
+
+    def report(self, what: str) -> None:
+        laps = " · ".join(f"{n} {ms}ms" for n, ms in self.phases)
+        print(f"[hotword] arranque: {laps} → {what} a los {time.monotonic() - self.t0:.2f}s", flush=True)
+
+STARTUP = StartupClock(_T_START)
 
 def log_env():
     print("[hotword] ===== ENTORNO =====", flush=True)
     print(f"PULSE_SERVER      = {PULSE_SERVER}", flush=True)
     print(f"PULSE_SOURCE      = {PULSE_SOURCE or '(no definido)'}", flush=True)
     print(f"ASSISTANT_URL     = {ASSISTANT_URL}", flush=True)
+    print(f"BARGE_IN_URL      = {BARGE_IN_URL or '(desactivado)'}", flush=True)
+    print(f"INGEST_URL        = {(INGEST_URL if WHISPER_STREAMING else '(sin WHISPER_STREAMING)') if INGEST_URL else '(desactivado)'}"
+          f"  timeout={INGEST_TIMEOUT}s", flush=True)
+    print(f"SESSION           = {SESSION_ID}", flush=True)
     print(f"MODEL/DEVICE      = {MODEL_SIZE}/{DEVICE}", flush=True)
-    print(f"BACKEND           = {BACKEND_ENV}", flush=True)
+    print(f"BACKEND           = {BACKEND_ENV}  preflight={PREFLIGHT}", flush=True)
     print(f"USE_PAREC_PIPE    = {USE_PAREC_PIPE}", flush=True)
     print(f"USE_PORCUPINE_PIPE= {USE_PORCUPINE_PIPE}", flush=True)
     print(f"KEYWORDS          = {KEYWORDS}  sens={SENS}  gain={GAIN_LINEAR}x", flush=True)
+    print(f"WAKE_PREROLL      = {WAKE_PREROLL_SEC}s  trim={WAKE_TRIM} (conserva ≤{WAKE_TRIM_KEEP}s)", flush=True)
+    print(f"WAKE_BEEP         = {('pacat' if EARCONS.pacat else 'aplay') if WAKE_BEEP else 'no'}", flush=True)
+    print(f"WHISPER_STREAMING = {WHISPER_STREAMING}  step={WHISPER_STREAM_STEP}s", flush=True)
+    print(f"WHISPER_POLICY    = greedy→beam{WHISPER_BEAM} si logprob<{WHISPER_MIN_LOGPROB} "
+          f"o nospeech>{WHISPER_MAX_NOSPEECH}  trim={WHISPER_TRIM}", flush=True)
+    print(f"WHISPER_CPU       = threads={WHISPER_CPU_THREADS} workers={WHISPER_NUM_WORKERS or 'auto'}  "
+          f"lote≤{WHISPER_BATCH}", flush=True)
+    print(f"PULSE_SOURCES     = {parse_sources(PULSE_SOURCES, PULSE_SOURCE)}", flush=True)
+    print(f"METRICS_PORT      = {METRICS_PORT or '(desactivado)'}", flush=True)
     print("[hotword] ===================", flush=True)
 
-def gen_beep_wav(path="/tmp/wake_beep.wav", hz=880, dur=0.12, rate=16000, vol=0.6):
-    try:
-        if os.path.exists(path): return path
-        n = int(rate * dur); frames = []
-        for i in range(n):
-            s = vol * math.sin(2.0 * math.pi * hz * (i / float(rate)))
-            frames.append(int(max(-1.0, min(1.0, s)) * 32767.0))
-        with wave.open(path, "wb") as wf:
-            wf.setnchannels(1); wf.setsampwidth(2); wf.setframerate(rate)
-            wf.writeframes(struct.pack("<" + "h"*len(frames), *frames))
-        return path
-    except Exception as e:
-        print(f"[hotword] beep wav error: {e}", flush=True); return None
+# Pitidos ya renderizados sobre un pacat que queda abierto (earcons.py)
+EARCONS = CuePlayer(enabled=WAKE_BEEP)
 
-def play_beep():
-    try:
-        wav = gen_beep_wav()
-        if wav: subprocess.Popen(["aplay", "-q", wav])
-    except Exception as e:
-        print(f"[hotword] beep error: {e}", flush=True)
-
-def vu_of_int16(pcm: array):
-    if not pcm: return (0.0, 0)
-    acc = 0.0; peak = 0
-    for v in pcm:
-        av = abs(v); peak = max(peak, av); acc += float(v)*float(v)
-    rms = math.sqrt(acc / len(pcm))
-    return (rms, peak)
-
-def clamp_int16(x: int) -> int:
-    if x > 32767: return 32767
-    if x < -32768: return -32768
-    return x
+def notify_barge_in():
+    """Avisa al assistant de que hay wakeword nueva para que corte la respuesta en curso.
+    Va en un hilo aparte: la escucha no espera a la respuesta HTTP."""
+    if not BARGE_IN_URL:
+        return
+    def _post():
+        try:
+            import requests
+            requests.post(BARGE_IN_URL, timeout=2)
+        except Exception as e:
+            print(f"[hotword] barge-in falló: {e}", flush=True)
+    threading.Thread(target=_post, daemon=True).start()
+
+class IngestStream:
+    """Un comando en streaming hacia /ingest: NDJSON por HTTP chunked con las
+    parciales confirmadas (``utt.partial``) mientras se transcribe y, con
+    ``finish()``, el texto final. Si la conexión falla antes de entregar el
+    final, dispatch usa /speak; la respuesta se espera ``INGEST_TIMEOUT`` como
+    mucho, no lo que dure la reproducción."""
+
+    def __init__(self, utt: Utterance):
+        self.utt = utt
+        self.closed = threading.Event()
+        self.response = None
+        self.error: Exception | None = None
+        self.delivered = False
+        self.thread = threading.Thread(target=self._post, name=f"hotword-ingest-{utt.id}", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _line(obj: dict) -> bytes:
+        return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def _lines(self):
+        utt = self.utt
+        yield self._line({"session": SESSION_ID, "source": utt.source})
+        sent, eos = "", False
+        while not self.closed.wait(0.05):
+            partial = strip_wakeword(utt.partial)
+            if partial and (partial != sent or (utt.done.is_set() and not eos)):
+                sent, eos = partial, utt.done.is_set()
+                yield self._line({"partial": sent, "eos": eos})
+        yield self._line({"final": utt.text} if utt.text else {"cancel": True})
+        self.delivered = True   # requests solo pide más cuerpo tras enviar la última línea
+
+    def _post(self):
+        import requests
+        try:
+            self.response = requests.post(INGEST_URL, data=self._lines(), timeout=(2, INGEST_TIMEOUT),
+                                          headers={"Content-Type": "application/x-ndjson"})
+        except Exception as e:
+            self.error = e
+
+    def finish(self) -> None:
+        """``utt.text`` ya es definitivo (vacío = nada que enviar)."""
+        self.closed.set()
+
+    def result(self):
+        """Respuesta de /ingest, o ``None`` si el final no llegó a entregarse
+        (hay que enviar por /speak). Entregado pero sin respuesta: error, sin
+        reenviar, que el assistant ya puede estar con él."""
+        self.thread.join(INGEST_TIMEOUT + 3)
+        if self.response is not None:
+            return self.response
+        if self.delivered:
+            raise TimeoutError(f"/ingest sin respuesta tras el texto final ({self.error or 'timeout'})")
+        print(f"[hotword] /ingest falló ({self.error or 'sin respuesta'}); envío por /speak", flush=True)
+        return None
+
+def wake_trim_offset(pre: np.ndarray, frame: int, threshold: float, keep: int) -> int:
+    """Dónde empieza el comando dentro del pre-roll ``pre`` (que acaba en la detección).
+
+    Porcupine dispara poco después de terminar la palabra, así que la wakeword
+    queda antes de los últimos ``keep`` samples: eso se corta siempre. Si hay
+    una pausa (trama en silencio) más cerca de la detección, se corta tras ella."""
+    floor = max(0, pre.size - keep) // frame * frame
+    quiet = np.flatnonzero(frame_rms(pre, frame) < threshold)
+    if quiet.size == 0:
+        return floor
+    return max(floor, int(quiet[-1] + 1) * frame)
+
+_WAKE_PREFIX = re.compile(r"^[\s¡!.,]*(?:%s)\b[\s,.;:!]*" % "|".join(re.escape(k) for k in KEYWORDS) if KEYWORDS else r"(?!)",
+                          re.IGNORECASE)
+
+def strip_wakeword(text: str) -> str:
+    """Quita una wakeword al principio del texto ("Jarvis, ¿qué hora es?" → "¿qué hora es?")."""
+    return _WAKE_PREFIX.sub("", text, count=1).strip() if text else text
 
 def list_pyaudio_devices():
+    import pyaudio
     pa = pyaudio.PyAudio()
     pulse_idx, first_input = None, None
     try:
@@ -107,23 +275,28 @@ def preflight_parec(secs=1, rate=16000):
         if not chunk: break
         pcm = array('h'); pcm.frombytes(chunk); got.extend(pcm)
     proc.kill()
-    rms, peak = vu_of_int16(got)
+    rms, peak = vu(got)
     print(f"[hotword] preflight parec RMS={rms:.1f} PEAK={peak}", flush=True)
     return len(got) > 0
 
 def run_rtsst_normal():
     print("[hotword] modo: RealtimeSTT wakeword (PyAudio)", flush=True)
-    dev_index, pa = list_pyaudio_devices()
-    if dev_index is None:
-        print("[hotword] ERROR: sin dispositivos de entrada", flush=True); return
-    preflight_parec(secs=1, rate=16000)
-    pa.terminate()
+    dev_index = None    # None: el dispositivo de entrada por defecto (Pulse)
+    if PREFLIGHT:
+        with STARTUP.phase("preflight"):
+            dev_index, pa = list_pyaudio_devices()
+            if dev_index is None:
+                print("[hotword] ERROR: sin dispositivos de entrada", flush=True); return
+            preflight_parec(secs=1, rate=16000)
+            pa.terminate()
+    with STARTUP.phase("import RealtimeSTT"):
+        from RealtimeSTT import AudioToTextRecorder
 
     common = dict(
         model=MODEL_SIZE, language=LANGUAGE, device=DEVICE,
         on_wakeword_detection_start=lambda: print("[hotword] → escuchando wakeword…", flush=True),
         on_wakeword_detection_end=lambda:   print("[hotword] ← deja de escuchar wakeword", flush=True),
-        on_wakeword_detected=lambda: (print("[hotword] WAKEWORD DETECTADA", flush=True), play_beep()),
+        on_wakeword_detected=lambda: (print("[hotword] WAKEWORD DETECTADA", flush=True), notify_barge_in(), EARCONS.play("wake")),
         on_recording_start=lambda: print("[hotword] ▶ grabación", flush=True),
         on_recording_stop=lambda:  print("[hotword] ■ fin grabación", flush=True),
         on_recorded_chunk=lambda b: (lambda r,p: print(f"[VU] rms={r:.1f} peak={p}", flush=True))(*vu_of_bytes(b)),
@@ -137,14 +310,17 @@ def run_rtsst_normal():
     )
 
     def vu_of_bytes(b):
-        pcm = array('h'); pcm.frombytes(b or b""); return vu_of_int16(pcm)
+        return vu(b or b"")
 
     recorder = None
-    if BACKEND_ENV == "oww":
-        recorder = AudioToTextRecorder(wakeword_backend="oww", openwakeword_model_paths="", **common)
-    if recorder is None:
-        recorder = AudioToTextRecorder(wakeword_backend="pvporcupine", wake_words=",".join(KEYWORDS), **common)
-
+    # RealtimeSTT carga Whisper en el constructor: aquí no se puede escuchar antes
+    with STARTUP.phase("recorder+whisper"):
+        if BACKEND_ENV == "oww":
+            recorder = AudioToTextRecorder(wakeword_backend="oww", openwakeword_model_paths="", **common)
+        if recorder is None:
+            recorder = AudioToTextRecorder(wakeword_backend="pvporcupine", wake_words=",".join(KEYWORDS), **common)
+
+    STARTUP.report("escuchando")
     print(f"🎤 Di {KEYWORDS} …", flush=True)
     import requests
     while True:
@@ -153,7 +329,7 @@ def run_rtsst_normal():
             if not txt or not txt.strip(): continue
             q = txt.strip(); print(f"🗣️  {q}", flush=True)
             try:
-                r = requests.post(ASSISTANT_URL, json={"question": q}, timeout=60)
+                r = requests.post(ASSISTANT_URL, json={"question": q, "session": SESSION_ID}, timeout=60)
                 if r.status_code != 200:
                     print(f"[hotword] Assistant HTTP {r.status_code}: {r.text}", flush=True)
             except Exception as e:
@@ -163,191 +339,418 @@ def run_rtsst_normal():
         except Exception as e:
             print(f"[hotword] loop error: {e}", flush=True); time.sleep(1)
 
-def _load_whisper_safely():
+def _load_whisper_safely(workers: int = 1):
+    from faster_whisper import WhisperModel
     want_device = DEVICE
+    # cpu_threads: hilos intra-op de CTranslate2; num_workers: decodificaciones en paralelo
+    threads = dict(cpu_threads=WHISPER_CPU_THREADS, num_workers=workers)
     try:
         if want_device.lower() == "cuda":
             print(f"[hotword] cargando faster-whisper: {MODEL_SIZE} (float32) en cuda …", flush=True)
-            return WhisperModel(MODEL_SIZE, device="cuda", compute_type="float32")
+            return WhisperModel(MODEL_SIZE, device="cuda", compute_type="float32", **threads)
         else:
-            print(f"[hotword] cargando faster-whisper: {MODEL_SIZE} (int8) en cpu …", flush=True)
-            return WhisperModel(MODEL_SIZE, device="cpu", compute_type="int8")
+            print(f"[hotword] cargando faster-whisper: {MODEL_SIZE} (int8) en cpu, {WHISPER_CPU_THREADS} hilos …", flush=True)
+            return WhisperModel(MODEL_SIZE, device="cpu", compute_type="int8", **threads)
     except RuntimeError as e:
         msg = str(e)
         print(f"[hotword] aviso al cargar en {want_device}: {msg}", flush=True)
         print("[hotword] fallback → CPU int8", flush=True)
-        return WhisperModel(MODEL_SIZE, device="cpu", compute_type="int8")
+        return WhisperModel(MODEL_SIZE, device="cpu", compute_type="int8", **threads)
+
+class SourceListener:
+    """Una fuente Pulse: su parec, anillo, Porcupine, VU y endpointing, con
+    un hilo de captura y otro de detección. Los comandos van a ``utt_q``,
+    compartida por todas las fuentes."""
+
+    def __init__(self, sid: str, source: str, porcupine, utt_q: StageQueue, tagged: bool):
+        self.sid = sid
+        self.source = source
+        self.porcupine = porcupine
+        self.rate = porcupine.sample_rate      # 16000
+        self.frame = porcupine.frame_length    # 512 (32ms)
+        self.utt_q = utt_q
+        self.tag = f"[hotword:{sid}]" if tagged else "[hotword]"
+        self.proc = None
+        self.ring = None
+        self.frames_q = StageQueue(f"tramas:{sid}" if tagged else "tramas", PIPE_FRAME_QUEUE)
+        self.stop = threading.Event()
+        self.threads = []
+
+        # Fin de habla: ENDPOINTER=adaptive (suelo de ruido) | energy (SILENCE_RMS fijo) | webrtc
+        self.vad = make_endpointer(ENDPOINTER, self.rate, self.frame,
+                                   silence_rms=SILENCE_RMS_THRESHOLD,
+                                   margin_db=VAD_MARGIN_DB, webrtc_mode=WEBRTC_VAD_MODE)
+        self.endpoint = EndpointTracker(self.vad, min_talk=MIN_TALK_SEC, max_cmd=MAX_CMD_SEC,
+                                        hang_min=SILENCE_HANG_MIN, hang_max=SILENCE_HANG_SEC,
+                                        start_timeout=SPEECH_START_TIMEOUT)
+        self.preroll_samples = int(WAKE_PREROLL_SEC * self.rate) // self.frame * self.frame
+        self.vu_meter = VuMeter()
+        self.gain_buf = np.empty(self.frame, dtype=np.int16)
+        self.next_vu_ts = 0.0
+
+    def log(self, msg: str) -> None:
+        print(f"{self.tag} {msg}", flush=True)
+
+    def start(self, stream=None) -> bool:
+        """Arranca parec, o lee de ``stream`` (cualquier objeto con ``readinto``
+        que dé s16le mono a ``rate``; p.ej. el replay de bench/replay.py)."""
+        if stream is None:
+            cmd = ["parec"]
+            if self.source:
+                cmd += ["-d", self.source]
+            cmd += ["--rate", str(self.rate), "--format", "s16le", "--channels", "1"]
+            self.log(f"exec: {' '.join(cmd)}")
+            try:
+                self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=0)
+            except FileNotFoundError:
+                self.log("ERROR: parec no disponible")
+                return False
+            stream = self.proc.stdout
+        # La detección puede ir hasta PIPE_FRAME_QUEUE tramas por detrás de la captura
+        lag_sec = PIPE_FRAME_QUEUE * self.frame / float(self.rate)
+        ring_sec = max(CAPTURE_RING_SEC, MAX_CMD_SEC + WAKE_PREROLL_SEC + lag_sec + 1.0)
+        self.ring = PcmRing(stream, self.frame, ring_sec, rate=self.rate)
+        self.log(f"anillo de captura: {self.ring.seconds(self.ring.capacity):.1f}s  "
+                 f"endpointing: {self.vad.describe()} hang={SILENCE_HANG_MIN}-{SILENCE_HANG_SEC}s")
+        self.utt_q.add_producer()
+        self.threads = [threading.Thread(target=fn, name=f"hotword-{fn.__name__}-{self.sid}", daemon=True)
+                        for fn in (self.capture, self.detect)]
+        for th in self.threads:
+            th.start()
+        return True
+
+    def close(self) -> None:
+        self.stop.set()
+        if self.proc is not None:
+            try: self.proc.terminate()
+            except Exception: pass
+        for th in self.threads:
+            th.join(2.0)
+        try: self.porcupine.delete()
+        except Exception: pass
 
-def run_pipe_porcupine():
-    """PAREC + Porcupine (no bloqueante) + grabación propia + transcripción con faster-whisper."""
-    print("[hotword] modo: PAREC + Porcupine + faster-whisper (EOS por silencio)", flush=True)
+    def capture(self):
+        """Vacía parec sin parar; las tramas viajan como posición en el anillo."""
+        ring = self.ring
+        while not self.stop.is_set():
+            if ring.read_frame() is None:
+                if self.proc is None or self.proc.poll() is not None:
+                    self.log("parec terminó")
+                    break
+                time.sleep(0.005)
+                continue
+            self.frames_q.put((ring.total - self.frame, time.monotonic()))
+        self.frames_q.close()
+
+    def feed_vu(self, pcm: np.ndarray, gain: bool) -> np.ndarray:
+        # Solo desde el hilo de detección (gain_buf y vu_meter no se comparten)
+        if gain and GAIN_LINEAR != 1.0:
+            # La ganancia va a un buffer aparte: el anillo guarda la señal original
+            pcm = apply_gain(pcm, GAIN_LINEAR, out=self.gain_buf)
+        # VU cada ~1s
+        now = time.time()
+        self.vu_meter.feed(pcm)
+        if now >= self.next_vu_ts:
+            rms, peak = self.vu_meter.take()
+            print(f"[VU]{'' if self.tag == '[hotword]' else ' ' + self.sid} rms={rms:.1f} peak={peak}", flush=True)
+            self.next_vu_ts = now + 1.0
+        return pcm
 
+    def enqueue(self, utt: Utterance) -> None:
+        if not self.utt_q.put(utt):
+            self.log(f"AVISO: Whisper no da abasto; descartado un comando ({format_stats([self.utt_q])})")
+
+    def begin(self, keyword: str, t: float, detect_pos: int) -> Utterance:
+        ring, frame = self.ring, self.frame
+        rec_start = max(ring.oldest, detect_pos - self.preroll_samples)
+        if WAKE_TRIM and detect_pos > rec_start:
+            cut = wake_trim_offset(ring.slice(rec_start, detect_pos), frame, self.vad.quiet_rms(),
+                                   int(WAKE_TRIM_KEEP * self.rate))
+            if cut:
+                self.log(f"recorto wakeword: {ring.seconds(cut):.2f}s")
+            rec_start += cut
+        # El pre-roll cuenta para el endpointing: puede que el usuario ya esté hablando
+        self.endpoint.begin((f, vu(f)[0]) for f in
+                            (ring.slice(p, p + frame) for p in range(rec_start, detect_pos, frame)))
+        utt = Utterance(keyword, t, ring=ring, start=rec_start, rate=self.rate, source=self.sid)
+        utt.t_detect = time.monotonic()
+        utt.end = detect_pos
+        utt.quiet_rms = self.vad.quiet_rms()
+        if WHISPER_STREAMING:
+            self.enqueue(utt)   # Whisper empieza ya, con el audio que va llegando
+        return utt
+
+    def finish(self, utt: Utterance, end: int, keep: bool = True) -> None:
+        utt.end = end
+        audio = self.ring.slice(utt.start, end)
+        if audio.size == 0 or not keep:
+            self.log("nada grabado; vuelvo a wake")
+        else:
+            # Copia: la captura sigue escribiendo en el anillo mientras Whisper trabaja
+            utt.audio = audio.copy() if audio.base is not None else audio
+            utt.quiet_rms = self.vad.quiet_rms()
+            if not WHISPER_STREAMING:
+                self.enqueue(utt)
+        utt.done.set()
+
+    def detect(self):
+        """Porcupine y, tras la wakeword, la grabación hasta fin de habla."""
+        ring, frame_len = self.ring, self.frame
+        utt = None
+        pos = 0
+        last_drop = 0
+        try:
+            while True:
+                pos, t = self.frames_q.get()
+                try:
+                    if pos < ring.oldest:
+                        continue    # la detección fue más lenta que una vuelta de anillo
+                    frame = ring.slice(pos, pos + frame_len)
+
+                    if utt is None:
+                        self.vad.observe(frame, vu(frame)[0])
+                        pcm = self.feed_vu(frame, gain=True)
+                        if self.frames_q.dropped != last_drop:
+                            last_drop = self.frames_q.dropped
+                            self.log(f"AVISO: detección atrasada ({format_stats([self.frames_q])})")
+                        try:
+                            idx = self.porcupine.process(pcm)
+                        except Exception as e:
+                            self.log(f"porcupine.process error: {e}")
+                            idx = -1
+                        if idx < 0:
+                            continue
+
+                        self.log(f"WAKEWORD DETECTADA: {KEYWORDS[idx]} (idx={idx})")
+                        telemetry.wake(self.sid, KEYWORDS[idx])
+                        notify_barge_in()
+                        EARCONS.play("wake")
+
+                        # El pre-roll ya está en el anillo: lo que se dijo mientras Porcupine
+                        # procesaba y arrancaba el beep no se pierde
+                        detect_pos = pos + frame_len
+                        preroll    = min(self.preroll_samples, detect_pos - ring.oldest)
+                        self.log(f"▶ grabación (pre-roll {ring.seconds(preroll):.2f}s)")
+                        utt = self.begin(KEYWORDS[idx], t, detect_pos)
+                        continue
+
+                    p = self.feed_vu(frame, gain=False)
+                    utt.end = pos + frame_len
+
+                    rms, peak = vu(p)
+                    reason = self.endpoint.step(p, rms)
+                    if reason is None:
+                        continue
+                    self.log(f"■ fin grabación ({reason}; {self.endpoint.summary()})")
+                    telemetry.recorded(self.sid, ring.seconds(pos + frame_len - utt.start), reason)
+                    utt.t_eos = t
+                    self.finish(utt, pos + frame_len, keep=reason != "sin voz")
+                    utt = None
+                except ValueError as e:
+                    # El anillo ya sobrescribió ese audio (detección muy atrasada): se pierde
+                    # este comando, no el hilo; la fuente sigue escuchando
+                    self.log(f"AVISO: audio fuera del anillo ({e}); descarto "
+                             f"{'la grabación' if utt is not None else 'la trama'}")
+                    telemetry.error("ring")
+                    if utt is not None:
+                        utt.done.set()      # sin audio: transcribe lo da por vacío
+                        utt = None
+        except QueueClosed:
+            if utt is not None:
+                self.log("parec terminó durante grabación")
+                telemetry.recorded(self.sid, ring.seconds(utt.end - utt.start), "eof")
+                utt.t_eos = time.monotonic()
+                self.finish(utt, utt.end)
+        finally:
+            self.utt_q.producer_done()
+
+def run_pipe_porcupine(streams: dict | None = None, preload: bool = False) -> tuple[list, list]:
+    """PAREC + Porcupine (no bloqueante) + grabación propia + transcripción con faster-whisper.
+    Con varias fuentes en PULSE_SOURCES hay una captura/detección por fuente y un solo Whisper.
+
+    ``streams`` (``{id: objeto con readinto}``) sustituye a parec y ``preload``
+    carga Whisper antes de escuchar (bench/replay.py). Devuelve los comandos
+    transcritos y las colas, para medir."""
     print("[hotword] modo: PAREC + Porcupine + faster-whisper (EOS por silencio)", flush=True)
-    model = _load_whisper_safely()
-    print("[hotword] faster-whisper listo.", flush=True)
 
-    cmd = ["parec"]
-    if PULSE_SOURCE:
-        cmd += ["-d", PULSE_SOURCE]
-    cmd += ["--rate", "16000", "--format", "s16le", "--channels", "1"]
-    print(f"[hotword] exec: {' '.join(cmd)}", flush=True)
-    try:
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=0)
-    except FileNotFoundError:
-        print("[hotword] ERROR: parec no disponible", flush=True)
-        return
+    sources = [(sid, "") for sid in streams] if streams else parse_sources(PULSE_SOURCES, PULSE_SOURCE)
+    workers = WHISPER_NUM_WORKERS or cpu_budget(len(sources) if WHISPER_STREAMING else 1)[1]
 
+    # Primero lo barato y lo que puede fallar (pvporcupine, parec); Whisper carga después, en paralelo
     try:
-        import pvporcupine
+        with STARTUP.phase("import pvporcupine"):
+            import pvporcupine
     except Exception as e:
         print("[hotword] ERROR: pvporcupine no está instalado:", e, flush=True)
-        proc.terminate()
-        return
-    porcupine = pvporcupine.create(keywords=KEYWORDS, sensitivities=[SENS]*len(KEYWORDS))
-    RATE  = porcupine.sample_rate      # 16000
-    FRAME = porcupine.frame_length     # 512 (32ms)
-    BYTES_PER_SAMPLE = 2
+        return [], []
+
+    utt_q  = StageQueue("transcribir", PIPE_UTT_QUEUE * len(sources))
+    send_q = StageQueue("enviar",      PIPE_SEND_QUEUE)
+    listeners = []
+    with STARTUP.phase("porcupine"):
+        # Porcupine guarda estado entre tramas: una instancia por fuente
+        for sid, source in sources:
+            porcupine = pvporcupine.create(keywords=KEYWORDS, sensitivities=[SENS]*len(KEYWORDS))
+            listeners.append(SourceListener(sid, source, porcupine, utt_q, tagged=len(sources) > 1))
+    RATE = listeners[0].rate
+    FRAME = listeners[0].frame
     print(f"[hotword] Porcupine rate={RATE} frame={FRAME}", flush=True)
-    print(f"🎤 Di {KEYWORDS} …", flush=True)
-    play_beep()
-    play_beep()
-    play_beep()
-
-    from array import array
-    def read_exact(nbytes: int) -> bytes:
-        buf = b""
-        while len(buf) < nbytes:
-            chunk = proc.stdout.read(nbytes - len(buf))
-            if not chunk:
-                break
-            buf += chunk
-        return buf
-
-    vu_bucket = array('h')
-    next_vu_ts = 0.0
-    def feed_vu(raw_bytes: bytes, apply_gain: bool) -> array:
-        nonlocal vu_bucket, next_vu_ts
-        pcm = array('h')
-        if raw_bytes:
-            pcm.frombytes(raw_bytes)
-            if apply_gain and GAIN_LINEAR != 1.0:
-                for i, v in enumerate(pcm):
-                    pcm[i] = clamp_int16(int(v * GAIN_LINEAR))
-        # VU cada ~1s
-        now = time.time()
-        vu_bucket.extend(pcm)
-        if now >= next_vu_ts:
-            rms, peak = vu_of_int16(vu_bucket)
-            print(f"[VU] rms={rms:.1f} peak={peak}", flush=True)
-            vu_bucket = array('h')
-            next_vu_ts = now + 1.0
-        return pcm
-
-    MIN_TALK_SEC           = float(os.environ.get("MIN_TALK_SEC", "0.6"))
-    MAX_CMD_SEC            = float(os.environ.get("MAX_CMD_SEC",  "8"))
-    SILENCE_RMS_THRESHOLD  = float(os.environ.get("SILENCE_RMS",  "700"))
-    SILENCE_HANG_SEC       = float(os.environ.get("SILENCE_HANG", "0.8"))
+    queues = [l.frames_q for l in listeners] + [utt_q, send_q]
+    if telemetry.serve(METRICS_PORT):
+        telemetry.watch_queues(queues)
+    finished = []
 
-    min_frames_rec   = int((RATE / FRAME) * MIN_TALK_SEC)
-    max_frames_rec   = int((RATE / FRAME) * MAX_CMD_SEC)
-    silence_frames   = int((RATE / FRAME) * SILENCE_HANG_SEC)
+    # Whisper carga mientras ya se escucha; los comandos que lleguen antes esperan en utt_q
+    whisper = {}
+    whisper_ready = threading.Event()
 
-    try:
-        while True:
-            raw = read_exact(FRAME * BYTES_PER_SAMPLE)
-            if not raw:
-                if proc.poll() is not None:
-                    print("[hotword] parec terminó", flush=True)
-                    break
-                time.sleep(0.005)
-                continue
+    def load_whisper():
+        try:
+            with STARTUP.phase("whisper"):
+                model = _load_whisper_safely(workers)
+            policy = DecodePolicy(model, LANGUAGE, rate=RATE, frame=FRAME, beam_size=WHISPER_BEAM,
+                                  min_logprob=WHISPER_MIN_LOGPROB, max_no_speech=WHISPER_MAX_NOSPEECH,
+                                  trim=WHISPER_TRIM)
+            whisper["policy"] = policy
+            whisper["streamer"] = StreamingTranscriber(policy, WHISPER_STREAM_STEP)
+            print(f"[hotword] faster-whisper listo ({workers} worker(s), {len(sources)} fuente(s)).", flush=True)
+            STARTUP.report("whisper listo")
+        except Exception as e:
+            print(f"[hotword] ERROR cargando faster-whisper: {e}", flush=True)
+        finally:
+            whisper_ready.set()
 
-            pcm = feed_vu(raw, apply_gain=True)
+    if preload:
+        load_whisper()
+    else:
+        threading.Thread(target=load_whisper, name="hotword-whisper-load", daemon=True).start()
+
+    with STARTUP.phase("parec"):
+        for l in list(listeners):
+            if not l.start(streams[l.sid] if streams else None):
+                listeners.remove(l)
+                l.close()
+    if not listeners:
+        return [], queues
+    STARTUP.report("escuchando")
+    print(f"🎤 Di {KEYWORDS} …", flush=True)
+    EARCONS.play("ready")
+
+    def take_batch() -> list:
+        """El siguiente comando y, si hay varias fuentes, los que terminen a la vez."""
+        batch = [utt_q.get()]
+        if WHISPER_STREAMING or len(listeners) == 1:
+            return batch
+        deadline = time.monotonic() + WHISPER_BATCH_WAIT
+        while len(batch) < WHISPER_BATCH:
             try:
-                idx = porcupine.process(pcm)
-            except Exception as e:
-                print(f"[hotword] porcupine.process error: {e}", flush=True)
-                idx = -1
-
-            if idx < 0:
-                continue
-
-            print(f"[hotword] WAKEWORD DETECTADA: {KEYWORDS[idx]} (idx={idx})", flush=True)
-            play_beep()
-
-            recorded = array('h')
-            frames_seen     = 0
-            silent_in_a_row = 0
-            started_ts      = time.time()
-            preroll = int(RATE / FRAME * 0.3)
-
-            for _ in range(preroll):
-                r = read_exact(FRAME * BYTES_PER_SAMPLE)
-                if not r: break
-                p = feed_vu(r, apply_gain=False)
-                recorded.extend(p)
-                frames_seen += 1
-
-            print("[hotword] ▶ grabación", flush=True)
+                batch.append(utt_q.get(timeout=max(0.0, deadline - time.monotonic())))
+            except (TimeoutError, QueueClosed):
+                break
+        return batch
 
+    def transcribe():
+        try:
             while True:
-                r = read_exact(FRAME * BYTES_PER_SAMPLE)
-                if not r:
-                    if proc.poll() is not None:
-                        print("[hotword] parec terminó durante grabación", flush=True)
-                        break
-                    time.sleep(0.002)
-                    continue
-
-                p = feed_vu(r, apply_gain=False)
-                recorded.extend(p)
-                frames_seen += 1
-
-                rms, peak = vu_of_int16(p)
-                if rms < SILENCE_RMS_THRESHOLD and frames_seen > min_frames_rec:
-                    silent_in_a_row += 1
-                else:
-                    silent_in_a_row = 0
-
-                if silent_in_a_row >= silence_frames:
-                    print("[hotword] ■ fin grabación (silencio)", flush=True)
-                    break
-                if frames_seen >= max_frames_rec:
-                    print("[hotword] ■ fin grabación (max timeout)", flush=True)
-                    break
-
-            if len(recorded) == 0:
-                print("[hotword] nada grabado; vuelvo a wake", flush=True)
-                continue
-
-            import numpy as np
-            pcm_np = np.asarray(recorded, dtype=np.int16).astype(np.float32) / 32768.0
-
-            print(f"[hotword] transcribiendo… muestras={len(pcm_np)} (~{len(pcm_np)/RATE:.2f}s)", flush=True)
-            segments, info = model.transcribe(pcm_np, language=LANGUAGE, vad_filter=False, beam_size=5)
-            text = "".join(seg.text for seg in segments).strip()
-            print(f"🗣️  {text if text else '(vacío)'}", flush=True)
-
-            if text:
+                batch = take_batch()
+                if not whisper_ready.is_set():
+                    print(f"[hotword] Whisper aún cargando; {len(batch) + len(utt_q)} comando(s) en espera…", flush=True)
+                    whisper_ready.wait()
+                policy, streamer = whisper.get("policy"), whisper.get("streamer")
                 try:
-                    import requests
-                    r = requests.post(ASSISTANT_URL, json={"question": text}, timeout=60)
+                    if policy is None:
+                        raise RuntimeError("faster-whisper no disponible")
+                    if WHISPER_STREAMING:
+                        utt = batch[0]
+                        if INGEST_URL:
+                            utt.ingest = IngestStream(utt)
+                        print(f"[hotword] transcribiendo #{utt.id} en streaming…", flush=True)
+                        info = utt.decode = streamer.run(utt, quiet_rms=utt.quiet_rms)
+                        print(f"[hotword] #{utt.id} streaming: {info}", flush=True)
+                    else:
+                        secs = " + ".join(f"{u.audio.size/RATE:.2f}s" for u in batch)
+                        print(f"[hotword] transcribiendo {', '.join(f'#{u.id}' for u in batch)}… (~{secs})", flush=True)
+                        results = policy.decode_batch([u.audio for u in batch], [u.quiet_rms for u in batch])
+                        for utt, res in zip(batch, results):
+                            utt.text, utt.decode = res.text, res.meta
+                            print(f"[hotword] #{utt.id} decode: {res.describe()}", flush=True)
+                except Exception as e:
+                    print(f"[hotword] error transcribiendo: {e}", flush=True)
+                    telemetry.error("transcribe")
+                    for utt in batch:
+                        utt.done.wait()
+                for utt in batch:
+                    utt.text = strip_wakeword(utt.text)
+                    utt.t_text = time.monotonic()
+                    if utt.ingest is not None:
+                        utt.ingest.finish()
+                    if utt.t_eos is not None:
+                        telemetry.transcribed("streaming" if WHISPER_STREAMING else "batch", utt.t_text - utt.t_eos)
+                    finished.append(utt)
+                    src = f"[{utt.source}] " if len(listeners) > 1 else ""
+                    print(f"🗣️  {src}{utt.text if utt.text else '(vacío)'}", flush=True)
+                    if utt.text:
+                        if not send_q.put(utt):
+                            print(f"[hotword] AVISO: assistant no da abasto; descartado un comando ({format_stats(queues)})", flush=True)
+                    else:
+                        print(f"[hotword] listo; escuchando wakeword otra vez.", flush=True)
+        except QueueClosed:
+            pass
+        finally:
+            send_q.producer_done()
+
+    def dispatch():
+        """Envía al assistant por una sesión keep-alive; no frena a las demás etapas."""
+        import requests
+        http = requests.Session()
+        try:
+            while True:
+                utt = send_q.get()
+                try:
+                    r = utt.ingest.result() if utt.ingest is not None else None
+                    if r is None:
+                        r = http.post(ASSISTANT_URL, json={"question": utt.text, "session": SESSION_ID,
+                                                           "source": utt.source}, timeout=60)
                     if r.status_code != 200:
                         print(f"[hotword] Assistant HTTP {r.status_code}: {r.text}", flush=True)
+                        telemetry.error("dispatch")
+                        EARCONS.play("error")
+                    elif utt.ingest is not None and utt.ingest.response is r:
+                        print(f"[hotword] #{utt.id} /ingest: especulación {r.json().get('speculation')}", flush=True)
                 except Exception as e:
                     print(f"[hotword] error enviando a assistant: {e}", flush=True)
-
-            print(f"[hotword] listo; escuchando wakeword otra vez.", flush=True)
-
+                    telemetry.error("dispatch")
+                    EARCONS.play("error")
+                utt.t_sent = time.monotonic()
+                telemetry.dispatched(utt.t_sent - utt.t_text)
+                print(f"[hotword] #{utt.id} {utt.timings()}  colas: {format_stats(queues)}", flush=True)
+                print(f"[hotword] listo; escuchando wakeword otra vez.", flush=True)
+        except QueueClosed:
+            pass
+        finally:
+            http.close()
+
+    stages = [threading.Thread(target=transcribe, name=f"hotword-transcribe-{i}", daemon=True)
+              for i in range(workers)]
+    for _ in stages:
+        send_q.add_producer()
+    stages.append(threading.Thread(target=dispatch, name="hotword-dispatch", daemon=True))
+    for th in stages:
+        th.start()
+    try:
+        # Termina cuando la última etapa ha vaciado su cola (parec cerrado)
+        while stages[-1].is_alive():
+            stages[-1].join(0.5)
     except KeyboardInterrupt:
         print("[hotword] detenido por usuario.", flush=True)
     finally:
-        try: porcupine.delete()
-        except Exception: pass
-        try: proc.terminate()
-        except Exception: pass
+        for l in listeners:
+            l.close()
+        print(f"[hotword] colas: {format_stats(queues)}", flush=True)
+    return finished, queues
 
 def main():
+    STARTUP.lap("imports")
     print("[hotword] iniciando…", flush=True)
     log_env()
     if USE_PORCUPINE_PIPE:
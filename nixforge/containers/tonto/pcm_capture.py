@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Captura PCM s16le de parec sin copias: ``readinto`` sobre un búfer circular.
+
+El anillo es un ``np.int16`` preasignado cuya capacidad es múltiplo de la
+trama, así que cada trama cae entera en su hueco y se entrega como vista, sin
+``bytes`` intermedios. Las posiciones son absolutas (muestras desde el
+arranque) para poder pedir después cualquier tramo aún no sobrescrito.
+"""
+
+import math
+import numpy as np
+
+class PcmRing:
+    """Anillo de ``seconds`` segundos alimentado desde ``stream.readinto``.
+
+    Las vistas que devuelve ``read_frame``/``slice`` siguen siendo válidas
+    hasta que la captura da la vuelta al anillo. El hueco que se está llenando
+    no cuenta como historia: quedan ``capacity - frame`` muestras legibles.
+    """
+
+    def __init__(self, stream, frame: int, seconds: float, rate: int = 16000):
+        self.stream = stream
+        self.frame = frame
+        self.rate = rate
+        nframes = math.ceil(seconds * rate / frame) + 1   # +1: el hueco en curso
+        self.capacity = nframes * frame
+        self.buf = np.zeros(self.capacity, dtype=np.int16)
+        self._raw = memoryview(self.buf).cast("B")
+        self.total = 0          # muestras escritas desde el arranque
+
+    def read_frame(self) -> np.ndarray | None:
+        """Lee una trama completa en su hueco y devuelve la vista; ``None`` en EOF."""
+        off = self.total % self.capacity
+        dst = self._raw[off * 2:(off + self.frame) * 2]
+        got = 0
+        while got < len(dst):
+            n = self.stream.readinto(dst[got:])
+            if not n:
+                return None     # EOF (la trama parcial se descarta)
+            got += n
+        self.total += self.frame
+        return self.buf[off:off + self.frame]
+
+    @property
+    def oldest(self) -> int:
+        """Primera posición absoluta que sigue en el anillo."""
+        return max(0, self.total + self.frame - self.capacity)
+
+    def slice(self, start: int, end: int | None = None) -> np.ndarray:
+        """Muestras ``[start, end)`` en un array contiguo: vista si no cruza el
+        final del anillo, una sola copia si lo cruza."""
+        end = self.total if end is None else end
+        if start < self.oldest or end > self.total or start > end:
+            raise ValueError(f"tramo [{start}, {end}) fuera del anillo [{self.oldest}, {self.total})")
+        a, b = start % self.capacity, end % self.capacity
+        if end - start == 0:
+            return self.buf[:0]
+        if a < b or b == 0:
+            return self.buf[a:b or self.capacity]
+        return np.concatenate((self.buf[a:], self.buf[:b]))
+
+    def seconds(self, samples: int) -> float:
+        return samples / float(self.rate)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Piezas del pipeline de hotword.py: colas acotadas entre etapas y el objeto
+que viaja por ellas (captura → detección → transcripción → envío).
+
+Ninguna etapa bloquea a la anterior: si una cola se llena se descarta el
+elemento más antiguo y se cuenta, así la captura nunca deja de vaciar parec.
+"""
+
+import itertools
+import threading
+from collections import deque
+
+class QueueClosed(Exception):
+    """La etapa anterior terminó y ya no quedan elementos."""
+
+class StageQueue:
+    """Cola acotada que descarta lo más antiguo al llenarse, con contadores."""
+
+    def __init__(self, name: str, maxsize: int):
+        self.name = name
+        self.maxsize = max(1, maxsize)
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._producers = 0
+        self.puts = 0
+        self.overflows = 0      # veces que la cola estaba llena al meter
+        self.dropped = 0        # elementos descartados por ello
+        self.high_water = 0
+
+    def put(self, item) -> bool:
+        """Mete sin bloquear; devuelve False si hubo que descartar algo."""
+        with self._cond:
+            if self._closed:
+                return False
+            ok = True
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.overflows += 1
+                self.dropped += 1
+                ok = False
+            self._items.append(item)
+            self.puts += 1
+            self.high_water = max(self.high_water, len(self._items))
+            self._cond.notify()
+            return ok
+
+    def get(self, timeout: float | None = None):
+        """Saca el siguiente; ``QueueClosed`` cuando está cerrada y vacía,
+        ``TimeoutError`` si vence ``timeout``."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self._closed, timeout):
+                raise TimeoutError(self.name)
+            if self._items:
+                return self._items.popleft()
+            raise QueueClosed(self.name)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def add_producer(self) -> None:
+        with self._cond:
+            self._producers += 1
+
+    def producer_done(self) -> None:
+        """Cuando termina el último productor registrado, la cola se cierra."""
+        with self._cond:
+            self._producers -= 1
+            last = self._producers <= 0
+        if last:
+            self.close()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"depth": len(self._items), "max": self.maxsize, "puts": self.puts,
+                    "overflows": self.overflows, "dropped": self.dropped,
+                    "high_water": self.high_water}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+class Utterance:
+    """Un comando: audio recortado del anillo y marcas de tiempo por etapa
+    (``time.monotonic()``; ``None`` mientras la etapa no ha pasado).
+
+    Mientras se graba, ``start``/``end`` son posiciones absolutas en ``ring``
+    y ``end`` avanza con cada trama; ``done`` se activa en el fin de habla,
+    cuando ``audio`` ya tiene la copia definitiva."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, keyword: str, t_wake: float, ring=None, start: int = 0, rate: int = 16000,
+                 source: str = ""):
+        self.id = next(self._ids)
+        self.keyword = keyword
+        self.source = source
+        self.ring = ring
+        self.start = start
+        self.end = start
+        self.done = threading.Event()
+        self.audio = None       # np.int16 copiado del anillo (la captura sigue escribiendo)
+        self.quiet_rms = None   # nivel de silencio de su fuente, para recortar antes de Whisper
+        self.rate = rate
+        self.text = ""
+        self.partial = ""
+        self.decode = None      # métricas de Whisper (``Decoded.meta`` o las del streaming)
+        self.ingest = None      # IngestStream de hotword.py si las parciales van a /ingest
+        self.t_wake = t_wake
+        self.t_detect = None    # cuando la detección vio la wakeword (t_wake: cuando se capturó)
+        self.t_eos = None
+        self.t_text = None
+        self.t_sent = None
+
+    def timings(self) -> dict:
+        def ms(a, b):
+            return round((b - a) * 1000) if a is not None and b is not None else None
+        return {
+            "audio_s": round(self.audio.size / self.rate, 2) if self.audio is not None else 0.0,
+            "wake_to_eos_ms": ms(self.t_wake, self.t_eos),
+            "eos_to_text_ms": ms(self.t_eos, self.t_text),
+            "text_to_sent_ms": ms(self.t_text, self.t_sent),
+        }
+
+def format_stats(queues) -> str:
+    return "  ".join(
+        f"{q.name}={s['depth']}/{s['max']} hw={s['high_water']} drop={s['dropped']}"
+        for q, s in ((q, q.stats()) for q in queues)
+    )
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Transcripción incremental mientras el usuario aún habla (faster-whisper).
+
+Cada ``step`` segundos de audio nuevo se decodifica la ventana que va desde
+el último punto confirmado hasta el presente. De cada hipótesis se confirma
+el prefijo de palabras que coincide con la hipótesis anterior
+(LocalAgreement-2) y la ventana avanza hasta el final de la última palabra
+confirmada, según sus marcas de tiempo. Al llegar el fin de habla solo queda
+por decodificar esa cola corta. Las parciales van en greedy; la cola pasa
+por la política completa (``whisper_policy``), con beam si hace falta.
+"""
+
+import re
+import numpy as np
+
+_PUNCT = re.compile(r"[^\w]+", re.UNICODE)
+
+def _norm(word: str) -> str:
+    return _PUNCT.sub("", word).lower()
+
+def _agreed(prev: list, cur: list) -> int:
+    """Número de palabras iniciales en las que coinciden dos hipótesis."""
+    n = 0
+    for (a, _), (b, _) in zip(prev, cur):
+        if not _norm(a) or _norm(a) != _norm(b):
+            break
+        n += 1
+    return n
+
+class StreamingTranscriber:
+    """Transcribe una ``Utterance`` viva de hotword.py.
+
+    La utterance trae el anillo (``ring``), su inicio absoluto (``start``),
+    el final que la detección va moviendo (``end``) y el evento ``done``;
+    al cerrarse, ``audio`` contiene la copia definitiva desde ``start``.
+    """
+
+    def __init__(self, policy, step_sec: float = 1.0):
+        self.policy = policy
+        self.step_sec = step_sec
+
+    def _words(self, pcm: np.ndarray, origin: int, rate: int, prompt: str) -> list:
+        """Decodifica ``pcm`` en greedy y devuelve ``[(palabra, fin_absoluto), …]``."""
+        res = self.policy.decode(pcm, prompt=prompt, word_timestamps=True, trim=False, fallback=False)
+        out = []
+        for seg in res.segments:
+            for w in (seg.words or []):
+                out.append((w.word, origin + int(w.end * rate)))
+        return out
+
+    def run(self, utt, quiet_rms: float | None = None) -> dict:
+        """Bloquea hasta ``utt.done``; deja el texto en ``utt.text`` y devuelve
+        contadores (decodificaciones parciales, segundos de cola) y la
+        decisión de la política para la cola."""
+        ring, rate = utt.ring, utt.rate
+        step = int(self.step_sec * rate)
+        committed: list[str] = []
+        pos = utt.start                 # inicio de lo no confirmado (absoluto)
+        prev: list = []
+        decoded_to = pos
+        partials = 0
+
+        while not utt.done.wait(0.05):
+            end = utt.end
+            if end - decoded_to < step:
+                continue
+            try:
+                window = ring.slice(pos, end).copy()
+            except ValueError:
+                break                   # el anillo ya dio la vuelta: se resuelve en la cola
+            cur = self._words(window, pos, rate, "".join(committed).strip())
+            decoded_to = end
+            partials += 1
+            n = _agreed(prev, cur)
+            if n:
+                committed.extend(w for w, _ in cur[:n])
+                pos = cur[n - 1][1]
+                utt.partial = "".join(committed).strip()
+            prev = cur[n:]
+
+        utt.done.wait()
+        if utt.audio is None:
+            # Descartada (p.ej. el endpointing no oyó voz): las parciales serían
+            # alucinaciones sobre silencio; solo cuentan para el log
+            utt.text = ""
+            return {"partials": partials, "tail_s": 0.0, "discarded": len(committed)}
+        tail = utt.audio[max(0, pos - utt.start):]
+        info = {"partials": partials, "tail_s": round(tail.size / rate, 2)}
+        text = ""
+        if tail.size:
+            res = self.policy.decode(tail, quiet_rms=quiet_rms, prompt="".join(committed).strip())
+            text, info["tail"] = res.text, res.describe()
+        utt.text = ("".join(committed).strip() + " " + text).strip()
+        return info
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Métricas Prometheus de hotword.py (``HOTWORD_METRICS_PORT``, 0 = apagado).
+
+Si ``prometheus_client`` no está instalado todo queda en no-op: las
+funciones se pueden llamar igual y el daemon no depende de ello.
+"""
+
+try:
+    from prometheus_client import Counter, Histogram, start_http_server
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+except ImportError:          # pragma: no cover - depende del venv
+    Counter = Histogram = None
+
+_SECONDS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16)
+
+if Counter is not None:
+    _WAKES = Counter("hotword_wake_detections_total", "Wakewords detectadas", ["source", "keyword"])
+    _ENDS = Counter("hotword_recordings_total", "Grabaciones terminadas por motivo de corte",
+                    ["source", "reason"])
+    _REC_SECONDS = Histogram("hotword_recording_seconds", "Duración de cada grabación (con pre-roll)",
+                             ["source"], buckets=(0.5, 1, 2, 3, 4, 6, 8, 12))
+    _STT_SECONDS = Histogram("hotword_transcription_seconds",
+                             "Del fin de habla al texto (lo que se espera a Whisper)", ["mode"], buckets=_SECONDS)
+    _SEND_SECONDS = Histogram("hotword_dispatch_seconds", "Envío al assistant", buckets=_SECONDS)
+    _ERRORS = Counter("hotword_errors_total", "Errores por etapa", ["stage"])
+
+class _QueueCollector:
+    """Profundidad, máximo y descartes de las ``StageQueue`` en cada scrape."""
+
+    def __init__(self, queues):
+        self.queues = queues
+
+    def collect(self):
+        depth = GaugeMetricFamily("hotword_queue_depth", "Elementos en cola", labels=["queue"])
+        high = GaugeMetricFamily("hotword_queue_high_water", "Máximo de elementos en cola", labels=["queue"])
+        dropped = CounterMetricFamily("hotword_queue_dropped", "Elementos descartados por cola llena "
+                                      "(en 'tramas': tramas de audio perdidas)", labels=["queue"])
+        for q in self.queues:
+            st = q.stats()
+            depth.add_metric([q.name], st["depth"])
+            high.add_metric([q.name], st["high_water"])
+            dropped.add_metric([q.name], st["dropped"])
+        yield from (depth, high, dropped)
+
+def serve(port: int) -> bool:
+    if not port:
+        return False
+    if Counter is None:
+        print("[metrics] prometheus_client no instalado; sin métricas", flush=True)
+        return False
+    try:
+        start_http_server(port)
+    except OSError as e:
+        print(f"[metrics] no se pudo abrir :{port}: {e}", flush=True)
+        return False
+    print(f"[metrics] http://0.0.0.0:{port}/metrics", flush=True)
+    return True
+
+def watch_queues(queues) -> None:
+    if Counter is not None:
+        REGISTRY.register(_QueueCollector(list(queues)))
+
+def wake(source: str, keyword: str) -> None:
+    if Counter is not None:
+        _WAKES.labels(source, keyword).inc()
+
+def recorded(source: str, seconds: float, reason: str) -> None:
+    if Counter is not None:
+        _ENDS.labels(source, reason).inc()
+        _REC_SECONDS.labels(source).observe(seconds)
+
+def transcribed(mode: str, seconds: float) -> None:
+    if Counter is not None:
+        _STT_SECONDS.labels(mode).observe(seconds)
+
+def dispatched(seconds: float) -> None:
+    if Counter is not None:
+        _SEND_SECONDS.observe(seconds)
+
+def error(stage: str) -> None:
+    if Counter is not None:
+        _ERRORS.labels(stage).inc()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Política de decodificación de faster-whisper para hotword.py.
+
+Primero una pasada greedy (``beam_size=1``, temperatura 0), que para
+comandos cortos y claros basta. Solo si la confianza es baja (``avg_logprob``
+bajo o ``no_speech_prob`` alto) se repite con beam search. Antes se recorta
+el silencio de los extremos, que Whisper también tendría que decodificar.
+
+``decode_batch`` junta varios comandos (de fuentes distintas que han
+terminado a la vez) en una sola llamada greedy a CTranslate2.
+"""
+
+import os
+import time
+
+import numpy as np
+
+from audio_dsp import frame_rms
+
+def cpu_budget(streams: int = 1) -> tuple[int, int]:
+    """(cpu_threads, num_workers) por defecto: todos los núcleos que nos deja
+    el cgroup/afinidad menos uno para captura y detección, y un worker por
+    cada decodificación que deba poder ir en paralelo (``streams``)."""
+    try:
+        ncpu = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        ncpu = os.cpu_count() or 1
+    return max(1, ncpu - 1), max(1, min(streams, ncpu))
+
+class Decoded:
+    """Resultado de ``DecodePolicy.decode``: texto, segmentos ya consumidos,
+    muestras recortadas al inicio (para reubicar marcas de tiempo) y métricas."""
+
+    def __init__(self, text: str, segments: list, offset: int, meta: dict):
+        self.text = text
+        self.segments = segments
+        self.offset = offset
+        self.meta = meta
+
+    def describe(self) -> str:
+        m = self.meta
+        return (f"{m['policy']} {m['ms']}ms logprob={m['avg_logprob']:.2f} "
+                f"nospeech={m['no_speech_prob']:.2f} recorte={m['trimmed_s']:.2f}s")
+
+class DecodePolicy:
+    def __init__(self, model, language: str, *, rate: int = 16000, beam_size: int = 5,
+                 min_logprob: float = -0.7, max_no_speech: float = 0.6,
+                 trim: bool = True, trim_pad: float = 0.2, frame: int = 512):
+        self.model = model
+        self.language = language
+        self.rate = rate
+        self.beam_size = beam_size
+        self.min_logprob = min_logprob
+        self.max_no_speech = max_no_speech
+        self.trim = trim
+        self.pad = int(trim_pad * rate)
+        self.frame = frame
+        self._batch_ok = True
+
+    def _trim(self, pcm: np.ndarray, quiet_rms: float) -> tuple[int, int]:
+        """[a, b) sin el silencio de los extremos, con ``trim_pad`` de margen."""
+        loud = np.flatnonzero(frame_rms(pcm, self.frame) >= quiet_rms)
+        if loud.size == 0:
+            return 0, pcm.size
+        a = max(0, int(loud[0]) * self.frame - self.pad)
+        b = min(pcm.size, (int(loud[-1]) + 1) * self.frame + self.pad)
+        return a, b
+
+    def _run(self, audio: np.ndarray, beam: int, prompt: str, words: bool) -> list:
+        kw = dict(language=self.language, vad_filter=False, beam_size=beam,
+                  word_timestamps=words)
+        if beam == 1:
+            kw.update(best_of=1, temperature=0.0)
+        if prompt:
+            kw["initial_prompt"] = prompt
+        segments, _ = self.model.transcribe(audio, **kw)
+        return list(segments)
+
+    def _confidence(self, segments: list) -> tuple[float, float]:
+        if not segments:
+            return 0.0, 1.0
+        dur = [max(1e-3, s.end - s.start) for s in segments]
+        logprob = sum(s.avg_logprob * d for s, d in zip(segments, dur)) / sum(dur)
+        return logprob, max(s.no_speech_prob for s in segments)
+
+    def _verdict(self, logprob: float, no_speech: float) -> str:
+        """``ok``, ``silencio`` o ``beam`` según la confianza de la pasada greedy."""
+        low_lp = logprob < self.min_logprob
+        if no_speech > self.max_no_speech and low_lp:
+            # Whisper cree que no hay voz y tampoco está seguro del texto: silencio
+            return "silencio"
+        if low_lp or no_speech > self.max_no_speech:
+            return "beam"
+        return "ok"
+
+    def _bounds(self, pcm: np.ndarray, quiet_rms: float | None, trim: bool | None) -> tuple[int, int]:
+        if (self.trim if trim is None else trim) and quiet_rms is not None:
+            return self._trim(pcm, quiet_rms)
+        return 0, pcm.size
+
+    def _meta(self, policy: str, t0: float, logprob: float, no_speech: float,
+              pcm: np.ndarray, a: int, b: int) -> dict:
+        return {"policy": policy, "ms": round((time.monotonic() - t0) * 1000),
+                "avg_logprob": logprob, "no_speech_prob": no_speech,
+                "audio_s": round(pcm.size / self.rate, 2),
+                "trimmed_s": round((pcm.size - (b - a)) / self.rate, 2)}
+
+    def decode(self, pcm: np.ndarray, *, quiet_rms: float | None = None, prompt: str = "",
+               word_timestamps: bool = False, trim: bool | None = None,
+               fallback: bool = True, greedy_first: bool = True) -> Decoded:
+        t0 = time.monotonic()
+        a, b = self._bounds(pcm, quiet_rms, trim)
+        audio = pcm[a:b].astype(np.float32) / 32768.0
+
+        policy, verdict = "greedy", "beam"
+        segments, logprob, no_speech = [], 0.0, 1.0
+        if greedy_first or self.beam_size <= 1:
+            segments = self._run(audio, 1, prompt, word_timestamps)
+            logprob, no_speech = self._confidence(segments)
+            verdict = self._verdict(logprob, no_speech)
+        if verdict == "silencio":
+            segments, policy = [], "greedy→silencio"
+        elif verdict == "beam" and fallback and self.beam_size > 1:
+            segments = self._run(audio, self.beam_size, prompt, word_timestamps)
+            logprob, no_speech = self._confidence(segments)
+            policy = f"greedy→beam{self.beam_size}" if greedy_first else f"beam{self.beam_size}"
+
+        text = "".join(s.text for s in segments).strip()
+        return Decoded(text, segments, a, self._meta(policy, t0, logprob, no_speech, pcm, a, b))
+
+    def _generate_batch(self, audios: list) -> list:
+        """Una llamada greedy a CTranslate2 para varios audios (≤30 s cada uno):
+        ``[(texto, avg_logprob, no_speech_prob), …]``. Usa piezas internas de
+        faster-whisper; si cambian, ``decode_batch`` vuelve a decodificar uno a uno."""
+        import ctranslate2
+        from faster_whisper.audio import pad_or_trim
+        from faster_whisper.tokenizer import Tokenizer
+
+        m = self.model
+        tok = Tokenizer(m.hf_tokenizer, m.model.is_multilingual, task="transcribe", language=self.language)
+        feats = np.stack([pad_or_trim(m.feature_extractor(a)) for a in audios]).astype(np.float32)
+        prompt = list(tok.sot_sequence) + [tok.no_timestamps]
+        results = m.model.generate(ctranslate2.StorageView.from_array(feats), [prompt] * len(audios),
+                                   beam_size=1, return_scores=True, return_no_speech_prob=True,
+                                   suppress_blank=True)
+        out = []
+        for r in results:
+            ids = [t for t in r.sequences_ids[0] if t < tok.eot]
+            n = len(r.sequences_ids[0])
+            # Igual que faster-whisper: la puntuación viene normalizada por longitud
+            out.append((tok.decode(ids).strip(), r.scores[0] * n / (n + 1), r.no_speech_prob))
+        return out
+
+    def decode_batch(self, pcms: list, quiet_rms: list) -> list:
+        """Como ``decode`` para varios comandos a la vez; los dudosos se
+        repiten uno a uno con beam."""
+        if len(pcms) == 1 or not self._batch_ok:
+            return [self.decode(p, quiet_rms=q) for p, q in zip(pcms, quiet_rms)]
+        t0 = time.monotonic()
+        bounds = [self._bounds(p, q, None) for p, q in zip(pcms, quiet_rms)]
+        audios = [p[a:b].astype(np.float32) / 32768.0 for p, (a, b) in zip(pcms, bounds)]
+        try:
+            greedy = self._generate_batch(audios)
+        except Exception as e:
+            self._batch_ok = False
+            print(f"[whisper] lote no disponible ({type(e).__name__}: {e}); decodifico uno a uno", flush=True)
+            return [self.decode(p, quiet_rms=q) for p, q in zip(pcms, quiet_rms)]
+
+        out = []
+        for pcm, q, (a, b), (text, logprob, no_speech) in zip(pcms, quiet_rms, bounds, greedy):
+            verdict = self._verdict(logprob, no_speech)
+            if verdict == "beam" and self.beam_size > 1:
+                res = self.decode(pcm, quiet_rms=q, greedy_first=False)
+                res.meta["policy"] = f"lote{len(pcms)}→beam{self.beam_size}"
+                out.append(res)
+                continue
+            policy = f"lote{len(pcms)}" + ("→silencio" if verdict == "silencio" else "")
+            out.append(Decoded("" if verdict == "silencio" else text, [], a,
+                               self._meta(policy, t0, logprob, no_speech, pcm, a, b)))
+        return out